@@ -4,16 +4,12 @@ import typing
 import numpy as np
 import pandas as pd
 
-import torch
-
 import iara.records
-import iara.ml.dataset as iara_dataset
 import iara.processing.analysis as iara_proc
 import iara.processing.manager as iara_manager
-import iara.ml.models.trainer as iara_trn
-import iara.ml.models.cnn as iara_cnn
-import iara.ml.experiment as iara_exp
-import iara.ml.models.mlp as iara_mlp
+
+# torch, the dataset, the models and the experiment are imported where used, so scripts that
+# only process data do not load them
 
 class Directories:
     """A structure for configuring directories for locating and storing files."""
@@ -107,9 +103,11 @@ def default_collection(only_sample: bool = False,
         )
 
 def default_window_input():
+    import iara.ml.dataset as iara_dataset
     return iara_dataset.InputType.Window()
 
 def default_image_input():
+    import iara.ml.dataset as iara_dataset
     return iara_dataset.InputType.Image(n_windows=32, overlap=0.5)
 
 
@@ -133,7 +131,15 @@ def default_mel_managers(config_name: str,
                          classifiers: typing.List[Classifier],
                          collection: iara.records.CustomCollection,
                          data_processor: iara_manager.AudioFileProcessor,
-                         training_strategy: iara_trn.ModelTrainingStrategy = iara_trn.ModelTrainingStrategy.MULTICLASS):
+                         training_strategy: 'iara_trn.ModelTrainingStrategy' = None):
+    import torch
+    import iara.ml.models.trainer as iara_trn
+    import iara.ml.models.cnn as iara_cnn
+    import iara.ml.experiment as iara_exp
+    import iara.ml.models.mlp as iara_mlp
+
+    if training_strategy is None:
+        training_strategy = iara_trn.ModelTrainingStrategy.MULTICLASS
 
     manager_dict = {}
 
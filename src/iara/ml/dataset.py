@@ -6,8 +6,8 @@ import overrides
 import typing
 import tqdm
 import math
+import threading
 
-import pandas as pd
 import numpy as np
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -18,18 +18,34 @@ import iara.utils
 import iara.processing.manager as iara_proc_manager
 
 
+def to_tensor(data: np.array) -> torch.Tensor:
+    """ Convert processed data to a float32 tensor, sharing memory when the array is already a
+    writable float32 array (e.g. memory-mapped by iara.processing.storage.NumpyStorage). """
+    if data.dtype == np.float32 and data.flags.writeable:
+        return torch.from_numpy(data)
+    return torch.tensor(data, dtype=torch.float32)
+
+
 class ExperimentDataLoader():
     """
     Custom dataset loader for audio data, should be use to pre-load all data in a experiment to RAM
         avoiding multiple load along side fold trainings:
 
+    The loaded files are kept one after the other in a single float32 arena, with the first row
+        and the number of rows of each file in offset_map, so files, windows and consecutive files
+        are returned as views of the arena, without copies. The arena is reserved in chunks of
+        at least ARENA_CHUNK bytes, growing with its size, and trimmed to the data at the end of
+        pre_load.
+
     Attributes:
         MEMORY_LIMIT (int): Maximum size in bytes that can be loaded into memory.
             When a dataset exceeds this limit, the data is loaded partially as needed (Very low).
         N_WORKERS (int): Number of simultaneos threads to process run files and load data.
+        ARENA_CHUNK (int): Minimum size in bytes reserved each time the arena grows.
     """
     MEMORY_LIMIT = 2 * 1024 * 1024 * 1024  # bytes
     N_WORKERS = 8
+    ARENA_CHUNK = 64 * 1024 * 1024  # bytes
 
     def __init__(self,
                  processor: iara_proc_manager.AudioFileProcessor,
@@ -50,7 +66,11 @@ class ExperimentDataLoader():
         self.processor = processor
         self.file_ids = file_ids
         self.targets = targets
-        self.data_map = {}
+        self.arena = None
+        self.arena_size = 0
+        self.offset_map = {}
+        self.lock = threading.Lock()
+        self.opened_memory = 0
         self.size_map = {}
         self.target_map = {}
         self.memory_map = {}
@@ -60,22 +80,47 @@ class ExperimentDataLoader():
         self.max_interval = max_interval
 
     def pre_load(self, file_ids = None) -> None:
+        """ Process or/and load files to the arena, one after the other in the order of file_ids.
+
+        The files are opened first, giving the number of rows of each one, so the rows of all
+            files are reserved in order before the data is copied, each worker writing to the
+            slice of its file.
+
+        Args:
+            file_ids (typing.Iterable[int]): IDs of the audio files
+        """
 
         targets = [self.targets[index] for index, id in enumerate(self.file_ids) if id in file_ids]
 
+        new_targets = {}
+        for file_id, target in zip(file_ids, targets):
+            if file_id not in self.size_map:
+                new_targets.setdefault(file_id, target)
+        new_ids = list(new_targets.keys())
+
         with ThreadPoolExecutor(max_workers=ExperimentDataLoader.N_WORKERS) as executor:
-            futures = [executor.submit(self.__load, file_id, target) 
-                       for file_id, target in zip(file_ids, targets)]
+            self.opened_memory = self.total_memory
+            opened = list(tqdm.tqdm(executor.map(self.__open, new_ids), total=len(new_ids),
+                                    desc='Processing dataset', leave=False, ncols=120))
+
+            with self.lock:
+                starts = self.__reserve(new_ids, list(new_targets.values()),
+                                        [shape for shape, _ in opened])
+
+            futures = [executor.submit(self.__copy, start, data)
+                       for start, (_, data) in zip(starts, opened) if start is not None]
+            del opened
 
             for future in tqdm.tqdm(as_completed(futures), total=len(futures),
-                                    desc='Processing/Loading dataset', leave=False, ncols=120):
+                                    desc='Loading dataset', leave=False, ncols=120):
                 future.result()
 
-    def __get(self, file_id: int) -> pd.DataFrame:
-        try:
+        with self.lock:
+            if self.arena is not None and len(self.arena) > self.arena_size:
+                self.arena = self.arena[:self.arena_size].clone()
 
-            data_df, times = self.processor.get_data(file_id)
-            times = np.array(times)
+    def __get(self, file_id: int) -> np.array:
+        try:
 
             if self.central_offset_time is not None:
                 index = list(self.file_ids).index(file_id)
@@ -84,46 +129,104 @@ class ExperimentDataLoader():
                 try:
                     offset = int(offset) - self.max_interval/2
                 except ValueError:
-                    offset = times[0]
-
+                    offset = None
+
+                if offset is not None:
+                    # only the windows around the CPA are read from the processed data
+                    data, _ = self.processor.get_array(file_id,
+                                                       start_time = offset,
+                                                       end_time = offset + self.max_interval)
+                    return data
+
+                data, times = self.processor.get_array(file_id)
+                times = np.array(times)
+                offset = times[0]
                 indexes = np.where((times >= offset) & (times <= offset + self.max_interval))[0]
 
-                return data_df.iloc[indexes]
+                return data[indexes]
 
-            return data_df
+            data, _ = self.processor.get_array(file_id)
+            return data
 
         except Exception as e:
             # Tratar o erro capturando qualquer exceção
             print(f"Ocorreu um erro: {e}")
 
-    def __load(self, file_id: int, target) -> None:
-        """ Process or/and load a single file to data map
+    def __open(self, file_id: int) -> typing.Tuple[typing.Tuple[int, int], np.array]:
+        """ Process or/and open a single file, keeping its data while the files opened fit in
+        MEMORY_LIMIT (memory-mapped storages only read the data when it is copied)
 
         Args:
             file_id (int): IDs of the audio files
-            target (_type_): Target labels correspondent
-        """        
 
-        if file_id in self.size_map:
-            return
+        Returns:
+            typing.Tuple[typing.Tuple[int, int], np.array]: shape and data, None when not kept
+        """
+        data = self.__get(file_id)
+
+        with self.lock:
+            self.opened_memory += data.size * 4
+            if self.opened_memory >= ExperimentDataLoader.MEMORY_LIMIT:
+                return data.shape, None
 
-        data_df = self.__get(file_id)
+        return data.shape, data
 
-        memory = data_df.memory_usage(deep=True).sum()
+    def __reserve(self,
+                  file_ids: typing.List[int],
+                  targets: typing.List,
+                  shapes: typing.List[typing.Tuple[int, int]]) -> typing.List[int]:
+        """ Register opened files and reserve their rows at the end of the arena, in order,
+        reserving a new chunk if needed. Must be called holding the lock.
+
+        Args:
+            file_ids (typing.List[int]): IDs of the audio files
+            targets (typing.List): Target labels correspondent
+            shapes (typing.List[typing.Tuple[int, int]]): Shape of the data of each file
+
+        Returns:
+            typing.List[int]: First row of each file in the arena, None when not in memory
+        """
+        memory = sum(n_rows * n_cols * 4 for n_rows, n_cols in shapes)
 
         if self.total_memory < ExperimentDataLoader.MEMORY_LIMIT and \
                 (self.total_memory + memory) > ExperimentDataLoader.MEMORY_LIMIT:
-            self.data_map.clear()
+            self.arena = None
+            self.arena_size = 0
+            self.offset_map.clear()
 
         self.total_memory += memory
-
-        if self.total_memory < ExperimentDataLoader.MEMORY_LIMIT:   
-            self.data_map[file_id] = torch.tensor(data_df.values, dtype=torch.float32)
-
-        self.total_samples += len(data_df)
-        self.size_map[file_id] = len(data_df)
-        self.target_map[file_id] = target
-        self.memory_map[file_id] = memory
+        in_memory = self.total_memory < ExperimentDataLoader.MEMORY_LIMIT and len(shapes) > 0
+
+        for file_id, target, (n_rows, n_cols) in zip(file_ids, targets, shapes):
+            self.total_samples += n_rows
+            self.size_map[file_id] = n_rows
+            self.target_map[file_id] = target
+            self.memory_map[file_id] = n_rows * n_cols * 4
+
+        if not in_memory:
+            return [None] * len(file_ids)
+
+        n_rows = sum(n_rows for n_rows, _ in shapes)
+        if self.arena is None or self.arena_size + n_rows > len(self.arena):
+            n_cols = shapes[0][1]
+            capacity = 0 if self.arena is None else len(self.arena)
+            chunk_rows = max(ExperimentDataLoader.ARENA_CHUNK // (n_cols * 4), capacity // 2)
+            arena = torch.empty((max(self.arena_size + n_rows, capacity + chunk_rows), n_cols),
+                                dtype=torch.float32)
+            if self.arena is not None:
+                arena[:self.arena_size] = self.arena[:self.arena_size]
+            self.arena = arena
+
+        starts = []
+        for file_id, (n_rows, _) in zip(file_ids, shapes):
+            starts.append(self.arena_size)
+            self.offset_map[file_id] = (self.arena_size, n_rows)
+            self.arena_size += n_rows
+        return starts
+
+    def __copy(self, start: int, data: np.array) -> None:
+        """ Copy the data of a file to the rows reserved for it in the arena. """
+        self.arena[start:start + len(data)] = torch.from_numpy(np.asarray(data, dtype=np.float32))
 
     def get(self, file_id: int, offset: int, n_samples: int = 1) -> typing.Tuple[torch.Tensor, torch.Tensor]:
         """ Return data and target from offset sample of file_id
@@ -150,12 +253,37 @@ class ExperimentDataLoader():
 
     def get_all(self, file_id: int) -> torch.Tensor:
 
-        if file_id in self.data_map:
-            return self.data_map[file_id]
+        if file_id in self.offset_map:
+            start, n_rows = self.offset_map[file_id]
+            return self.arena[start:start + n_rows]
+
+        return to_tensor(self.__get(file_id))
+
+    def get_files(self, file_ids: typing.Iterable[int]) -> torch.Tensor:
+        """ Return the data of file_ids concatenated, a view of the arena when the files are
+        consecutive in it, otherwise gathered in one copy.
+
+        Args:
+            file_ids (typing.Iterable[int]): IDs of the audio files
+
+        Returns:
+            torch.Tensor: Windows of all files, in the order of file_ids
+        """
+        file_ids = list(file_ids)
+        if len(file_ids) == 0:
+            return torch.tensor([], dtype=torch.float32)
+
+        if not all(file_id in self.offset_map for file_id in file_ids):
+            return torch.cat([self.get_all(file_id) for file_id in file_ids])
+
+        ranges = [self.offset_map[file_id] for file_id in file_ids]
+        start = ranges[0][0]
+        if all(first == end for (first, _), end in
+               zip(ranges[1:], np.cumsum([n_rows for _, n_rows in ranges[:-1]]) + start)):
+            return self.arena[start:start + sum(n_rows for _, n_rows in ranges)]
 
-        data_df = self.__get(file_id)
-        data_df = torch.tensor(data_df.values, dtype=torch.float32)
-        return data_df
+        rows = np.concatenate([np.arange(first, first + n_rows) for first, n_rows in ranges])
+        return self.arena[torch.from_numpy(rows)]
 
 
     def __str__(self) -> str:
@@ -176,6 +304,11 @@ class BaseDataset(torch_data.Dataset):
         -> typing.Tuple[torch.tensor, torch.tensor]:
         """ """
 
+    @abc.abstractmethod
+    def get_batch(self, indexes: typing.Iterable[int]) -> typing.Tuple[torch.Tensor, torch.Tensor]:
+        """ Get the samples and targets of indexes stacked as a batch, as collated from
+        __getitem__ """
+
     @abc.abstractmethod
     def get_file_ids(self) -> typing.Iterable[int]:
         """ """
@@ -231,7 +364,7 @@ class AudioDataset(BaseDataset):
         self.input_type = input_type
         # self.file_ids = file_ids
         self.file_ids = []
-        self.limit_ids = [0]
+        limit_ids = [0]
 
         self.target_tensor = None
         self.sample_tensor = None
@@ -243,20 +376,102 @@ class AudioDataset(BaseDataset):
             # self.limit_ids.append(self.limit_ids[-1] + qty_windows)
 
             if qty_windows > 0:
-                self.limit_ids.append(self.limit_ids[-1] + qty_windows)
+                limit_ids.append(limit_ids[-1] + qty_windows)
                 self.file_ids.append(file_id)
 
+        # first sample of each file, and the total, sorted for the binary search in resolve
+        self.limit_ids = np.array(limit_ids, dtype=np.int64)
+        self.file_targets = np.array([loader.target_map[file_id] for file_id in self.file_ids],
+                                     dtype=np.int64)
+
     def __len__(self):
-        return self.limit_ids[-1]
+        return int(self.limit_ids[-1])
+
+    def resolve(self, indexes: typing.Union[int, np.array]) \
+            -> typing.Tuple[typing.Union[int, np.array], typing.Union[int, np.array]]:
+        """ Find the files and the offsets of samples by a binary search over limit_ids, for one
+        index or for an array of indexes at once (e.g. the indexes of a batch of a sampler).
+
+        Args:
+            indexes (typing.Union[int, np.array]): Sample indexes, negative ones counted from the
+                end as in sequences.
+
+        Raises:
+            IndexError: Raised when an index is out of the range of the dataset.
+
+        Returns:
+            typing.Tuple[typing.Union[int, np.array], typing.Union[int, np.array]]: Position of
+                the file of each sample in file_ids and offset of its first window in the file.
+        """
+        indexes = np.asarray(indexes, dtype=np.int64)
+        indexes = np.where(indexes < 0, indexes + len(self), indexes)
+        if np.any((indexes < 0) | (indexes >= len(self))):
+            raise IndexError(f'index out of range for {len(self)} samples')
+
+        positions = np.searchsorted(self.limit_ids, indexes, side='right') - 1
+        offsets = (indexes - self.limit_ids[positions]) * self.input_type.n_news
+
+        if positions.ndim == 0:
+            return int(positions), int(offsets)
+        return positions, offsets
 
     def __getitem__(self, index) -> typing.Tuple[torch.Tensor, torch.Tensor]:
 
-        current_id = next(i for i, valor in enumerate(self.limit_ids) if valor > index) - 1
-        offset_index = index - self.limit_ids[current_id]
+        if np.ndim(index) > 0:
+            # a batch of a BatchSampler, see get_batch
+            return self.get_batch(index)
 
-        return self.loader.get(self.file_ids[current_id],
-                               offset_index * self.input_type.n_news,
-                               self.input_type.n_windows)
+        position, offset = self.resolve(index)
+
+        return self.loader.get(self.file_ids[position], offset, self.input_type.n_windows)
+
+    def __getitems__(self, indexes: typing.List[int]) \
+            -> typing.List[typing.Tuple[torch.Tensor, torch.Tensor]]:
+        """ Samples of indexes for the automatic batching of torch DataLoader, gathered by
+        get_batch. """
+        samples, targets = self.get_batch(indexes)
+        return list(zip(samples, targets))
+
+    @overrides.override
+    def get_batch(self, indexes: typing.Iterable[int]) -> typing.Tuple[torch.Tensor, torch.Tensor]:
+        """ Gather the samples of indexes with one indexing per file, over the windows or over an
+        unfold view of the images of the file, and their targets from the file targets.
+
+        Used by a DataLoader with batch_size=None and a BatchSampler, the whole batch is
+            fetched in one call, without collating samples.
+
+        Args:
+            indexes (typing.Iterable[int]): Sample indexes.
+
+        Returns:
+            typing.Tuple[torch.Tensor, torch.Tensor]: Samples and targets, the same of stacking
+                the results of __getitem__ for each index.
+        """
+        positions, offsets = self.resolve(np.asarray(indexes, dtype=np.int64).reshape(-1))
+        n_windows = self.input_type.n_windows
+        n_news = self.input_type.n_news
+
+        samples = None
+        order = np.argsort(positions, kind='stable')
+        bounds = np.flatnonzero(np.diff(positions[order])) + 1
+        for rows in np.split(order, bounds):
+            if len(rows) == 0:
+                continue
+
+            data = self.loader.get_all(self.file_ids[positions[rows[0]]])
+
+            if n_windows == 1:
+                batch = data[torch.from_numpy(offsets[rows])].unsqueeze(1)
+            else:
+                images = data.unfold(0, n_windows, n_news).transpose(1, 2)
+                batch = images[torch.from_numpy(offsets[rows] // n_news)].unsqueeze(1)
+
+            if samples is None:
+                samples = torch.empty((len(positions),) + batch.shape[1:], dtype=batch.dtype)
+            samples[torch.from_numpy(rows)] = batch
+
+        targets = torch.from_numpy(self.file_targets[positions])
+        return samples, targets
 
     def __str__(self) -> str:
         total_memory = 0
@@ -269,14 +484,9 @@ class AudioDataset(BaseDataset):
 
         if self.target_tensor is None:
 
-            self.target_tensor = torch.tensor([], dtype=torch.float32)
-
-            for file_id in self.file_ids:
-                target = self.loader.target_map[file_id]
-                size = self.loader.size_map[file_id]
-
-                self.target_tensor = torch.cat([self.target_tensor,
-                                        torch.tensor([target] * size, dtype=torch.int32)])
+            sizes = [self.loader.size_map[file_id] for file_id in self.file_ids]
+            self.target_tensor = torch.tensor(np.repeat(self.file_targets, sizes),
+                                              dtype=torch.float32)
 
         return self.target_tensor
 
@@ -284,11 +494,7 @@ class AudioDataset(BaseDataset):
     def get_samples(self) -> torch.tensor:
 
         if self.sample_tensor is None:
-
-            self.sample_tensor = torch.tensor([], dtype=torch.float32)
-
-            for file_id in self.file_ids:
-                self.sample_tensor = torch.cat([self.sample_tensor, self.loader.get_all(file_id)])
+            self.sample_tensor = self.loader.get_files(self.file_ids)
 
         return self.sample_tensor
 
@@ -4,6 +4,7 @@ Experiment Module
 This module provides classes for configure, training and compare machine learning models.
 """
 import os
+import json
 import typing
 import datetime
 import itertools
@@ -393,6 +394,20 @@ class Manager():
         print(f'--- Dataset with {len(id_list)} n_folds ---')
         print(df)
 
+    def save_processor_stats(self) -> str:
+        """
+        Save the counters and timers of the dataset processor in this process (see
+            iara.processing.manager.AudioFileProcessor.get_stats) as processor_stats.json in the
+            output directory.
+
+        Returns:
+            str: The path of the saved file.
+        """
+        filename = os.path.join(self.config.output_base_dir, 'processor_stats.json')
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.config.dataset_processor.get_stats(), f, indent=4)
+        return filename
+
     def run(self, folds: typing.List[int] = range, override: bool = False, without_ret = False) -> typing.Dict:
         """Execute training based on the Config"""
         self.__prepare_output_dir(override=override)
@@ -442,6 +457,8 @@ class Manager():
                                 eval_strategy=eval_strategy,
                                 dataset_ids=id_set[eval_subset]['ID'].to_list())
 
+        self.save_processor_stats()
+
         if without_ret:
             return None
 
@@ -511,12 +511,19 @@ class OptimizerTrainer(BaseTrainer):
 
         os.makedirs(model_base_dir, exist_ok=True)
 
+        # whole batches are fetched by dataset.get_batch, as shuffle=True but without collating
         trn_loader = torch_data.DataLoader(trn_dataset,
-                                             batch_size=self.batch_size,
-                                             shuffle=True)
+                                             batch_size=None,
+                                             sampler=torch_data.BatchSampler(
+                                                    torch_data.RandomSampler(trn_dataset),
+                                                    batch_size=self.batch_size,
+                                                    drop_last=False))
         val_loader = torch_data.DataLoader(val_dataset,
-                                                batch_size=self.batch_size,
-                                                shuffle=True)
+                                                batch_size=None,
+                                                sampler=torch_data.BatchSampler(
+                                                    torch_data.RandomSampler(val_dataset),
+                                                    batch_size=self.batch_size,
+                                                    drop_last=False))
 
         container = self._prepare_for_training(trn_dataset=trn_dataset).items()
 
@@ -5,10 +5,15 @@ This module contains a class and functions for applying spectral analysis to inp
 """
 import enum
 import typing
+import tempfile
+import fractions
+import itertools
+import functools
+import contextlib
 
 import numpy as np
-import scipy.signal as sci
-import librosa
+
+# scipy.signal and librosa are imported where used, keeping the import of this module fast
 
 
 class SpectralAnalysis(enum.Enum):
@@ -33,8 +38,24 @@ class SpectralAnalysis(enum.Enum):
                 windows. Defaults to 0.
             - decimation_rate (int, optional): Decimation rate for downsampling the data.
                 Defaults to 1.
+            - decimation_engine (DecimationEngine, optional): Method to decimate the data, only
+                in apply, in apply_cached it is defined by the cache.
+                Defaults to DecimationEngine.CHEBYSHEV.
             - n_mels (int, optional): Number of Mel points, applicable only in Mel analysis.
                 Defaults to 256.
+            - integration_interval (float, optional): Duration in seconds to average consecutive
+                spectra. Defaults to None(no integration).
+            - integration_overlap (float, optional): Overlap in seconds between integration
+                windows. Defaults to 0.
+            - stft_integration (bool, optional): If True, integrate the STFT spectra as they are
+                computed, before the analysis specific transforms, so that the full resolution
+                spectrogram is never held in memory. Only in apply_cached. Defaults to False.
+            - dtype (type, optional): Floating point type of the processing, np.float32 or
+                np.float64, only in apply, in apply_cached it is defined by the cache.
+                Defaults to np.float64.
+            - frequency_limit (float, optional): Highest frequency in the output, only the
+                frequency bins (or mel bands) up to it are computed. The log mel spectrogram is
+                relative to the maximum in the band. Defaults to None(fs/2).
 
         Returns:
             typing.Tuple[np.array, np.array, np.array]: A tuple containing:
@@ -45,25 +66,62 @@ class SpectralAnalysis(enum.Enum):
         """
         power, freq, time = globals()[str(self)](*args, **kwargs)
 
-        integration_overlap = kwargs.get('integration_overlap', 0)
-        integration_interval = kwargs.get('integration_interval', None)
+        return integrate(power, freq, time,
+                         integration_interval = kwargs.get('integration_interval', None),
+                         integration_overlap = kwargs.get('integration_overlap', 0))
+
+    def apply_cached(self, cache: 'SignalCache', **kwargs):
+        """Perform spectral analysis over a SignalCache, sharing the decimation and the STFT
+            with other analyses over the same cache.
+
+        Args:
+            - cache (SignalCache): Input data for analysis.
+            - kwargs: Same as apply.
+
+        Returns:
+            typing.Tuple[np.array, np.array, np.array]: Same as apply.
+        """
+        names = ['n_pts', 'n_overlap', 'decimation_rate', 'frequency_limit']
+        if self == SpectralAnalysis.LOG_MELGRAM:
+            names.append('n_mels')
+        integration = (kwargs.get('integration_interval', None),
+                       kwargs.get('integration_overlap', 0))
+
+        def analysis():
+            return globals()['_' + str(self)](cache, **kwargs)
 
-        if integration_interval is None:
-            return power, freq, time
+        def integrated():
+            return integrate(*cache.get((Stage.TRANSFORM,) + key, analysis),
+                             integration_interval = integration[0],
+                             integration_overlap = integration[1])
 
-        delta_t = time[-1] - time[-2]
-        n_means = int(np.round(integration_interval / delta_t))
-        n_overlap = int(np.round((integration_interval-integration_overlap)/ delta_t))
+        analysis = cache.timed('analysis', analysis)
+        integrated = cache.timed('integrate', integrated)
 
-        final_power = []
-        final_times = []
+        if kwargs.get('stft_integration', False):
+            names += ['integration_interval', 'integration_overlap']
+            key = (str(self),) + tuple((name, kwargs.get(name, None)) for name in names)
+            return cache.get((Stage.INTEGRATED,) + key, analysis)
 
-        for i in range(0, len(time), n_overlap):
-            mean_spectrum = np.mean(power[:, i:i+n_means], axis=1)
-            final_power.append(mean_spectrum)
-            final_times.append(time[i])
+        key = (str(self),) + tuple((name, kwargs.get(name, None)) for name in names)
+        if integration[0] is None:
+            return cache.get((Stage.TRANSFORM,) + key, analysis)
 
-        return np.array(final_power).T, freq, final_times
+        return cache.get((Stage.INTEGRATED,) + key + integration, integrated)
+
+    def apply_stream(self, data: np.array, fs: float, **kwargs):
+        """Perform spectral analysis in blocks, with bounded memory for any data duration.
+
+        Args:
+            - data (np.array): Input data for analysis, may be a memory map.
+            - fs (float): Sampling frequency.
+            - kwargs: Same as apply, plus block_size, see stream.
+
+        Returns:
+            typing.Tuple[typing.Iterator[np.array], np.array, np.array]: As apply, with an
+                iterator over blocks of columns of the power spectrum.
+        """
+        return stream(self, data, fs, **kwargs)
 
 class Normalization(enum.Enum):
     """ Enum class representing the available normalizations in this module. """
@@ -109,13 +167,534 @@ class Normalization(enum.Enum):
         return self.apply(data)
 
 
-def decimate(data: np.array, rate: typing.Union[int, float]):
+class DecimationEngine(enum.Enum):
+    """ Enum class representing the available methods to decimate signals in this module. """
+    CHEBYSHEV = 0
+    POLYPHASE = 1
+
+    def __str__(self):
+        return str(self.name).rsplit('.', maxsplit=1)[-1].lower()
+
+    def apply(self, data: np.array, rate: typing.Union[int, float]) -> np.array:
+        """
+        Decimate the data.
+
+            CHEBYSHEV: Chebyshev type I zero-phase filtering followed by FFT resampling of the
+                whole signal.
+            POLYPHASE: Zero-phase FIR filtering and resampling by a rational factor with a
+                polyphase filter bank, that can also run in blocks (see decimate_blocks).
+
+        The result is float32 for float32 data and float64 otherwise.
+
+        Args:
+            data (np.array): The data to be decimated.
+            rate (typing.Union[int, float]): Decimation rate, integer or rational.
+
+        Returns:
+            np.array: The decimated data, with int(len(data) / rate) samples.
+        """
+        if self == DecimationEngine.CHEBYSHEV:
+            return _decimate_chebyshev(data, rate)
+
+        if self == DecimationEngine.POLYPHASE:
+            return _decimate_polyphase(data, rate)
+
+        raise UnboundLocalError(f"decimation {str(self)} not implemented")
+
+    def constant_response(self, n_samples: int,
+                          rate: typing.Union[int, float]) -> typing.Union[float, np.array]:
+        """
+        Output of apply for a unitary constant signal, such that
+            apply(data - c, rate) == apply(data, rate) - c * constant_response(len(data), rate)
+
+        Args:
+            n_samples (int): Number of samples of the signal.
+            rate (typing.Union[int, float]): Decimation rate.
+
+        Returns:
+            typing.Union[float, np.array]: The response, a scalar when it is constant.
+        """
+        if self == DecimationEngine.CHEBYSHEV:
+            import scipy.signal as sci
+            b, a = sci.cheby1(8, 0.05, 0.8 / rate, btype='low')
+            return (np.sum(b) / np.sum(a))**2
+
+        return self.apply(np.ones(n_samples), rate)
+
+    def apply_blocks(self, data: np.array, rate: typing.Union[int, float], block_size: int,
+                     offset: float = 0, dtype: type = None) -> typing.Iterator[np.array]:
+        """
+        Decimate data - offset in blocks of output samples, with the same result of apply.
+
+        Args:
+            data (np.array): The data to be decimated, may be a memory map.
+            rate (typing.Union[int, float]): Decimation rate, integer or rational.
+            block_size (int): Number of output samples in each block.
+            offset (float, optional): Value subtracted from the data. Defaults to 0.
+            dtype (type, optional): Floating point type of the result.
+                Defaults to None(as apply).
+
+        Raises:
+            UnboundLocalError: Raised when the engine can not decimate in blocks.
+
+        Yields:
+            np.array: Consecutive blocks of the decimated data.
+        """
+        if self == DecimationEngine.POLYPHASE:
+            return decimate_blocks(data, rate, block_size, offset, dtype)
+
+        raise UnboundLocalError(f"decimation {str(self)} in blocks not implemented")
+
+class Stage(enum.Enum):
+    """ Enum class representing the intermediate results of the analyses, in processing order,
+    that a SignalCache can keep in a stage store between processings. """
+    DECIMATED = 0
+    STFT = 1
+    TRANSFORM = 2
+    INTEGRATED = 3
+
+    def __str__(self):
+        return str(self.name).rsplit('.', maxsplit=1)[-1].lower()
+
+def decimate(data: np.array, rate: typing.Union[int, float],
+             engine: DecimationEngine = DecimationEngine.CHEBYSHEV):
+    return engine.apply(data, rate)
+
+def _float_dtype(data: np.array) -> type:
+    """ Floating point type to process data, float32 only when data is already float32. """
+    return np.float32 if data.dtype == np.float32 else np.float64
+
+def _decimate_chebyshev(data: np.array, rate: typing.Union[int, float]) -> np.array:
+    import scipy.signal as sci
     b, a = sci.cheby1(8, 0.05, 0.8 / rate, btype='low')
     y = sci.filtfilt(b, a, data)
-    return sci.resample(y, int(len(y) / rate))
+    return sci.resample(y, int(len(y) / rate)).astype(_float_dtype(data), copy=False)
+
+def _rate_to_fraction(rate: typing.Union[int, float]) -> typing.Tuple[int, int]:
+    """ Up and down sampling factors equivalent to a decimation rate. """
+    fraction = fractions.Fraction(rate).limit_denominator(10000)
+    return fraction.denominator, fraction.numerator
+
+@functools.lru_cache(maxsize=32)
+def _polyphase_filter(up: int, down: int) -> typing.Tuple[np.array, int]:
+    """ Low-pass FIR for resampling by up/down, with passband up to 0.8 of the output nyquist
+    frequency (as the CHEBYSHEV engine) and 80 dB of attenuation from the output nyquist.
+
+    Returns:
+        typing.Tuple[np.array, int]: Coefficients, pre-padded with zeros so that the filter delay
+            is a whole number of output samples, and that number of samples.
+    """
+    import scipy.signal as sci
+    max_rate = max(up, down)
+    n_taps, beta = sci.kaiserord(80, 0.2 / max_rate)
+    n_taps = n_taps + 1 - n_taps % 2
+    h = sci.firwin(n_taps, 0.9 / max_rate, window=('kaiser', beta)) * up
+
+    half_len = (n_taps - 1) // 2
+    n_pre_pad = (down - half_len % down) % down
+    return np.concatenate([np.zeros(n_pre_pad), h]), (half_len + n_pre_pad) // down
+
+def decimate_blocks(data: np.array, rate: typing.Union[int, float],
+                    block_size: int = 2**20, offset: float = 0,
+                    dtype: type = None) -> typing.Iterator[np.array]:
+    """Decimate the data with the polyphase engine, in blocks of output samples.
+
+    Each block reads only the input samples that contribute to it, so data may be a memory map
+        and the result is the same of DecimationEngine.POLYPHASE.apply.
+
+    Args:
+        data (np.array): The data to be decimated.
+        rate (typing.Union[int, float]): Decimation rate, integer or rational.
+        block_size (int, optional): Number of output samples in each block. Defaults to 2**20.
+        offset (float, optional): Value subtracted from the data before decimation.
+            Defaults to 0.
+        dtype (type, optional): Floating point type of the result, the filter always runs in
+            float64, since float32 rounding is above its stopband attenuation.
+            Defaults to None(float32 for float32 data and float64 otherwise).
+
+    Yields:
+        np.array: Consecutive blocks of the decimated data.
+    """
+    import scipy.signal as sci
+    up, down = _rate_to_fraction(rate)
+    h, shift = _polyphase_filter(up, down)
+    n_out = int(len(data) / rate)
+    dtype = _float_dtype(data) if dtype is None else dtype
+
+    for first in range(0, n_out, block_size):
+        end = min(first + block_size, n_out)
+
+        # input range contributing to the outputs, starting in a multiple of down so that the
+        # phase of the polyphase filter is kept
+        first_input = max(0, -(-((first + shift) * down - len(h) + 1) // up))
+        first_input = (first_input // down) * down
+        end_input = min(len(data), (end + shift - 1) * down // up + 1)
+
+        x = np.subtract(data[first_input:end_input], offset, dtype=np.float64)
+        y = sci.upfirdn(h, x, up, down)
+
+        first_output = first_input * up // down - shift
+        yield y[first - first_output:end - first_output].astype(dtype, copy=False)
+
+def _decimate_polyphase(data: np.array, rate: typing.Union[int, float]) -> np.array:
+    n_out = int(len(data) / rate)
+    return np.concatenate(list(decimate_blocks(data, rate, block_size=max(n_out, 1))))
+
+def integrate(power: np.array, freq: np.array, time: np.array,
+              integration_interval: float = None,
+              integration_overlap: float = 0) -> typing.Tuple[np.array, np.array, np.array]:
+    """Average consecutive spectra in integration windows.
+
+    Args:
+        power (np.array): 2D array representing power spectrum.
+        freq (np.array): 1D array with frequencies.
+        time (np.array): 1D array with the time of each spectrum.
+        integration_interval (float, optional): Duration in seconds of the integration window.
+            Defaults to None(no integration).
+        integration_overlap (float, optional): Overlap in seconds between integration windows.
+            Defaults to 0.
+
+    Returns:
+        typing.Tuple[np.array, np.array, np.array]: power, freq and time after integration.
+    """
+    if integration_interval is None:
+        return power, freq, time
+
+    n_means, n_step = _integration_steps(time[-1] - time[-2],
+                                         integration_interval, integration_overlap)
+
+    return _integrate_frames(power, n_means, n_step), freq, np.asarray(time)[::n_step]
+
+def _integration_steps(delta_t: float, integration_interval: float,
+                       integration_overlap: float) -> typing.Tuple[int, int]:
+    """ Number of spectra in each integration window and between the start of two windows. """
+    n_means = int(np.round(integration_interval / delta_t))
+    n_step = int(np.round((integration_interval-integration_overlap)/ delta_t))
+    return n_means, n_step
+
+def _integrate_frames(power: np.array, n_means: int, n_step: int) -> np.array:
+    """ Average the columns of power in windows of n_means columns starting every n_step columns,
+    the last windows being truncated at the end of power. """
+    n_frames = power.shape[1]
+    starts = np.arange(0, n_frames, n_step)
+    n_full = int(np.count_nonzero(starts + n_means <= n_frames))
+
+    result = np.empty((power.shape[0], len(starts)), dtype=np.result_type(power.dtype, np.float32))
+
+    if n_full > 0:
+        windows = np.lib.stride_tricks.sliding_window_view(power, n_means, axis=1)
+        np.mean(windows[:, :starts[n_full-1] + 1:n_step], axis=2, out=result[:, :n_full])
+
+    for i in range(n_full, len(starts)):
+        result[:, i] = np.mean(power[:, starts[i]:], axis=1)
+
+    return result
+
+def _integrate_stft(frame_spectra: typing.Callable[[int, int], np.array], n_frames: int,
+                    n_means: int, n_step: int, block_windows: int = 64) -> np.array:
+    """ Integrate the spectra of n_frames STFT frames, computing them in blocks of block_windows
+    integration windows with frame_spectra(first_frame, end_frame). """
+    starts = np.arange(0, n_frames, n_step)
+    blocks = []
+    for first_window in range(0, len(starts), block_windows):
+        end_window = min(first_window + block_windows, len(starts))
+        first_frame = starts[first_window]
+        end_frame = min(starts[end_window-1] + n_means, n_frames)
+
+        power = frame_spectra(first_frame, end_frame)
+        blocks.append(_integrate_frames(power, n_means, n_step)[:, :end_window - first_window])
+
+    return np.concatenate(blocks, axis=1)
+
+def _frames(data: np.array, n_fft: int, hop_length: int,
+            first_frame: int, end_frame: int) -> np.array:
+    """ Strided view with one STFT frame per row, from first_frame to end_frame. """
+    frames = np.lib.stride_tricks.sliding_window_view(data, n_fft)
+    return frames[first_frame * hop_length:(end_frame - 1) * hop_length + 1:hop_length]
+
+def _stft_frames(frames: np.array, window: np.array, out: np.array = None, first_bin: int = 0,
+                 end_bin: int = None, power: int = 1, scale: float = 1) -> np.array:
+    """ Magnitude, or power, of the rfft of each row of frames times window, scaled and written in
+    out with one frequency per row, from first_bin to end_bin. out is allocated with the dtype of
+    window when not given. """
+    spectrum = np.fft.rfft(np.multiply(frames, window, dtype=window.dtype), axis=1)
+    spectrum = spectrum[:, first_bin:end_bin]
+    if out is None:
+        out = np.empty((spectrum.shape[1], spectrum.shape[0]), dtype=window.dtype)
+
+    out_t = out.T
+    np.abs(spectrum, out=out_t)
+    if power == 2:
+        np.square(out_t, out=out_t)
+    elif power != 1:
+        np.power(out_t, power, out=out_t)
+    if scale != 1:
+        out_t *= scale
+    return out
+
+def stft(data: np.array, window: np.array, hop_length: int, first_frame: int = 0,
+         end_frame: int = None, first_bin: int = 0, end_bin: int = None, power: int = 1,
+         scale: float = 1, block_frames: int = 256) -> np.array:
+    """STFT magnitude over strided frames of the data, the core of all analyses in this module.
+
+    The frames are transformed in blocks, each one written straight into the preallocated
+        output, so the complex spectrum is only held for block_frames frames at once.
+
+    Args:
+        data (np.array): Input signal.
+        window (np.array): Window of the frames, its length is the number of points of the FFT
+            and its dtype (float32 or float64) the dtype of the computation and of the output.
+        hop_length (int): Number of samples between the start of two frames.
+        first_frame (int, optional): First frame to compute. Defaults to 0.
+        end_frame (int, optional): Frame to stop before. Defaults to None(all complete frames).
+        first_bin (int, optional): First frequency bin in the output. Defaults to 0.
+        end_bin (int, optional): Frequency bin to stop before. Defaults to None(all bins).
+        power (int, optional): Exponent of the magnitude, 1 for magnitude and 2 for power.
+            Defaults to 1.
+        scale (float, optional): Factor applied to the output. Defaults to 1.
+        block_frames (int, optional): Number of frames transformed at once. Defaults to 256.
+
+    Returns:
+        np.array: 2D array with one frequency per row and one frame per column.
+    """
+    n_fft = len(window)
+    if end_frame is None:
+        end_frame = 1 + (len(data) - n_fft) // hop_length
+
+    n_bins = len(range(n_fft//2 + 1)[first_bin:end_bin])
+    out = np.empty((n_bins, max(0, end_frame - first_frame)), dtype=window.dtype)
+    for first in range(first_frame, end_frame, block_frames):
+        end = min(first + block_frames, end_frame)
+        _stft_frames(_frames(data, n_fft, hop_length, first, end), window,
+                     out[:, first - first_frame:end - first_frame], first_bin, end_bin, power,
+                     scale)
+    return out
+
+# The windows, filterbanks and frequency axes depend only on the analysis parameters, so they are
+# built once per process and shared by all files. The shared arrays are read-only, the frequency
+# axes are returned as copies since they are part of the results.
+
+@functools.lru_cache(maxsize=32)
+def _window(n_fft: int, dtype: type = np.float64) -> np.array:
+    """ Hanning window of the STFT, read-only. """
+    window = np.hanning(n_fft).astype(dtype)
+    window.setflags(write=False)
+    return window
+
+@functools.lru_cache(maxsize=64)
+def _mel_filterbank(fs: float, n_fft: int, n_mels: int, fmax: float) -> np.array:
+    """ Mel filterbank of librosa.feature.melspectrogram, to be applied as filterbank @ power,
+    read-only. """
+    import librosa
+    filterbank = librosa.filters.mel(sr=fs, n_fft=n_fft, n_mels=n_mels, fmax=fmax)
+    filterbank.setflags(write=False)
+    return filterbank
+
+@functools.lru_cache(maxsize=64)
+def _cached_mel_frequencies(n_mels: int, fmax: float) -> np.array:
+    import librosa
+    return librosa.core.mel_frequencies(n_mels=n_mels, fmin=0.0, fmax=fmax)
+
+def _mel_frequencies(n_mels: int, fmax: float) -> np.array:
+    """ Center frequencies of the mel filterbank. """
+    return _cached_mel_frequencies(n_mels, fmax).copy()
+
+@functools.lru_cache(maxsize=64)
+def _cached_stft_frequencies(fs: float, n_fft: int) -> np.array:
+    return np.fft.rfftfreq(n_fft, 1/fs)[1:]
+
+def _stft_frequencies(fs: float, n_fft: int) -> np.array:
+    """ Frequencies of the STFT bins, without the DC bin. """
+    return _cached_stft_frequencies(fs, n_fft).copy()
+
+def _band_end(freqs: np.array, frequency_limit: float) -> int:
+    """ Number of the sorted freqs up to frequency_limit, found by binary search. """
+    if not frequency_limit:
+        return len(freqs)
+    return int(np.searchsorted(freqs, frequency_limit, side='right'))
+
+def _tpsw_band(n_bins: int, n_band: int) -> typing.Tuple[int, int, int]:
+    """ TPSW n and p parameters of a spectrum with n_bins, and the number of bins to keep over a
+    band of n_band bins so that the TPSW in the band is the same of the whole spectrum. Each of
+    the two passes of the filter looks n bins away, and n + 1 bins at the edges are weighted. """
+    n = int(round(n_bins * .04 / 2.0 + 1))
+    p = int(round(n / 8.0 + 1))
+    return n, p, min(n_bins, n_band + 2 * n + 2)
+
+def _mel_band(filterbank: np.array, frequency_limit: float,
+              mel_freqs: np.array) -> typing.Tuple[int, int]:
+    """ Number of mel bands up to frequency_limit and number of STFT bins used by them. """
+    n_bands = _band_end(mel_freqs, frequency_limit)
+    if n_bands == len(mel_freqs):
+        return n_bands, filterbank.shape[1]
+    used = np.flatnonzero(np.any(filterbank[:n_bands] != 0, axis=0))
+    return n_bands, int(used[-1]) + 1 if len(used) > 0 else 0
+
+class SignalCache():
+    """
+    Keeps the intermediate results of the analyses of one signal, so that several analyses and
+        configurations over the same signal share the decimation and the STFT.
+
+    The results of the stages in stages are also kept in stage_store, so that later processings
+        of the signal, in other configurations, start from the deepest stage already computed.
+        The data is only accessed when a result is not available, so it may be a memory map.
+    """
+
+    def __init__(self, data: np.array, fs: float,
+                 decimation_engine: DecimationEngine = DecimationEngine.CHEBYSHEV,
+                 dtype: type = np.float64, stage_store: typing.Any = None,
+                 stages: typing.Iterable[Stage] = (), stats: typing.Any = None) -> None:
+        """
+        Args:
+            data (np.array): Input data for analysis.
+            fs (float): Sampling frequency.
+            decimation_engine (DecimationEngine, optional): Method to decimate the data.
+                Defaults to DecimationEngine.CHEBYSHEV.
+            dtype (type, optional): Floating point type of all intermediate results, np.float32
+                or np.float64. Defaults to np.float64.
+            stage_store (typing.Any, optional): Store with load(key), returning None when the
+                key is not available, and save(key, value) methods, as
+                iara.processing.storage.StageStore. Defaults to None.
+            stages (typing.Iterable[Stage], optional): Stages kept in stage_store.
+                Defaults to ().
+            stats (typing.Any, optional): Collector of the time of each processing step, with
+                timer(name) and count(name, value) methods, as
+                iara.processing.manager.ProcessingStats. Defaults to None.
+        """
+        self.dtype = dtype
+        self.raw_data = data
+        self.fs = fs
+        self.decimation_engine = decimation_engine
+        self.stage_store = stage_store
+        self.stages = set(stages)
+        self.stats = stats
+        self.results = {}
+
+    def timer(self, name: str) -> typing.ContextManager:
+        """ Context timing a processing step in stats, if any. """
+        return contextlib.nullcontext() if self.stats is None else self.stats.timer(name)
+
+    def timed(self, name: str, function: typing.Callable[[], typing.Any]) \
+            -> typing.Callable[[], typing.Any]:
+        """ Wraps function to be timed as a processing step in stats, if any. """
+        def wrapper():
+            with self.timer(name):
+                return function()
+        return wrapper
+
+    @property
+    def data(self) -> np.array:
+        """ Input data in dtype, converted in the first access. """
+        return self.get(('data',), lambda: self.raw_data
+                        if np.dtype(self.dtype) == np.float64 else self.raw_data.astype(self.dtype))
+
+    @property
+    def mean(self) -> float:
+        """ Mean of the input data, computed in the first access. """
+        return self.get(('mean',), lambda: np.mean(self.raw_data))
+
+    def get_decimated(self, rate: typing.Union[int, float],
+                      remove_mean: bool) -> typing.Tuple[np.array, float]:
+        """Get the decimated signal, decimating only once for each rate.
+
+        Args:
+            rate (typing.Union[int, float]): Decimation rate.
+            remove_mean (bool): If True, the mean of the data is removed before decimation.
+
+        Returns:
+            typing.Tuple[np.array, float]: Decimated signal and its sampling frequency.
+        """
+        def compute():
+            offset = self.mean if remove_mean else 0
+            return decimate(np.subtract(self.data, offset, dtype=self.dtype), rate,
+                            self.decimation_engine), offset
+
+        data, cached_offset = self.get((Stage.DECIMATED, rate), self.timed('decimate', compute))
+
+        # the offset is either 0 or the mean, so the mean is only read when not cached
+        if remove_mean:
+            offset = cached_offset if cached_offset != 0 else self.mean
+        else:
+            offset = 0
+
+        if cached_offset != offset:
+            data = data + (cached_offset - offset) * \
+                    self.get(('constant_response', rate),
+                             lambda: self.decimation_engine.constant_response(len(self.raw_data),
+                                                                              rate))
+            data = data.astype(self.dtype, copy=False)
+
+        return data, self.fs/rate
+
+    def get(self, key: typing.Hashable, function: typing.Callable[[], typing.Any]) -> typing.Any:
+        """Get a result, evaluating function only in the first call for each key.
+
+        Keys starting with a Stage in stages are also loaded from and saved in the stage store.
+        """
+        if key not in self.results:
+            value = None
+            stored = self.stage_store is not None and key[0] in self.stages
+            if stored:
+                store_key = (str(self.decimation_engine), np.dtype(self.dtype).name) + key
+                with self.timer('stage_load'):
+                    value = self.stage_store.load(store_key)
+                if self.stats is not None:
+                    self.stats.count('stage_hits' if value is not None else 'stage_misses')
+
+            if value is None:
+                value = function()
+                if stored:
+                    with self.timer('stage_save'):
+                        self.stage_store.save(store_key, value)
+
+            self.results[key] = value
+        return self.results[key]
+
+def _tpsw_mean_convolution(data: np.array, h: np.array, ix: int, mult: np.array) -> np.array:
+    """ TPSW mean of each column of data by convolution, applied column by column. """
+    import scipy.signal as sci
+    n_pts = data.shape[0]
+
+    def apply_on_spectre(xs):
+        return sci.convolve(h, xs, mode='full')
+    mx = np.apply_along_axis(apply_on_spectre, arr=data, axis=0)
+
+    mx = mx[ix-1:n_pts+ix-1]
+    mx[:ix,:] = mx[:ix,:] * (np.matmul(mult, np.ones((1, data.shape[1]))))
+    mx[n_pts-ix:n_pts,:] = mx[n_pts-ix:n_pts,:] * \
+        np.matmul(np.flipud(mult),np.ones((1, data.shape[1])))
+    return mx
+
+def _tpsw_mean_cumsum(data: np.array, n: int, p: int, mult: np.array) -> np.array:
+    """ TPSW mean of each column of data in O(N) from the cumulative sum over the whole matrix.
+
+    The TPSW filter is the mean of the samples from p to n positions away on each side, so each
+        side is the difference of two points of the cumulative sum.
+    """
+    n_pts = data.shape[0]
+    ix = mult.shape[0]
+
+    # cumulative sum with a constant extension of n + 1 rows on each side, so that every window
+    # limit, clipped to the data, is a slice of it
+    offset = n + 1
+    cumsum = np.empty((n_pts + 2 * offset + 1, data.shape[1]), dtype=np.float64)
+    cumsum[:offset + 1] = 0
+    np.cumsum(data, axis=0, dtype=np.float64, out=cumsum[offset + 1:offset + n_pts + 1])
+    cumsum[offset + n_pts + 1:] = cumsum[offset + n_pts]
+
+    mx = cumsum[offset + n + 1:offset + n + 1 + n_pts] - cumsum[offset + p:offset + p + n_pts]
+    mx += cumsum[offset - p + 1:offset - p + 1 + n_pts]
+    mx -= cumsum[offset - n:offset - n + n_pts]
+
+    weights = np.full(n_pts, 1.0 / (2 * (n - p + 1)))
+    weights[:ix] = weights[:ix] * mult[:, 0]
+    weights[n_pts-ix:n_pts] = weights[n_pts-ix:n_pts] * np.flipud(mult)[:, 0]
+
+    mx *= weights[:, np.newaxis]
+    return mx.astype(data.dtype, copy=False)
 
 def tpsw(data: np.array, n_pts: int = None, n: int = None, p: int = None,
-         a: int = None) -> np.array:
+         a: int = None, vectorized: bool = True) -> np.array:
     """Perform TPSW data analysis
 
     Args:
@@ -127,6 +706,9 @@ def tpsw(data: np.array, n_pts: int = None, n: int = None, p: int = None,
             Defaults to None(int(round(n / 8.0 + 1)))
         a (int, optional): TPSW a parameter, threshold to saturate in the first pass filter.
             Defaults to None(2.0).
+        vectorized (bool, optional): If True, evaluate the filter by cumulative sums over the
+            whole matrix, in O(N) and without python loops. If False, convolve each column.
+            Defaults to True.
 
     Returns:
         np.array: processed data
@@ -149,29 +731,176 @@ def tpsw(data: np.array, n_pts: int = None, n: int = None, p: int = None,
     else:
         h = np.ones((1, 2 * n + 1))
         p = 1
+        vectorized = False
 
     h /= np.linalg.norm(h, 1)
-    def apply_on_spectre(xs):
-        return sci.convolve(h, xs, mode='full')
-    mx = np.apply_along_axis(apply_on_spectre, arr=data, axis=0)
 
     ix = int(np.floor((h.shape[0] + 1)/2.0))
-    mx = mx[ix-1:n_pts+ix-1]
     ixp = ix - p
     mult = 2 * ixp / \
         np.concatenate([np.ones(p-1) * ixp, range(ixp,2*ixp + 1)], axis=0)[:, np.newaxis]
-    mx[:ix,:] = mx[:ix,:] * (np.matmul(mult, np.ones((1, data.shape[1]))))
-    mx[n_pts-ix:n_pts,:] = mx[n_pts-ix:n_pts,:] * \
-        np.matmul(np.flipud(mult),np.ones((1, data.shape[1])))
 
+    def tpsw_mean(xs):
+        if vectorized:
+            return _tpsw_mean_cumsum(xs, n, p, mult)
+        return _tpsw_mean_convolution(xs, h, ix, mult)
+
+    mx = tpsw_mean(data)
     indl = (data-a*mx) > 0
     data = np.where(indl, mx, data)
-    mx = np.apply_along_axis(apply_on_spectre, arr=data, axis=0)
-    mx = mx[ix-1:n_pts+ix-1,:]
-    mx[:ix,:] = mx[:ix,:] * (np.matmul(mult,np.ones((1, data.shape[1]))))
-    mx[n_pts-ix:n_pts,:] = mx[n_pts-ix:n_pts,:] * \
-        (np.matmul(np.flipud(mult),np.ones((1,data.shape[1]))))
-    return mx
+    return tpsw_mean(data)
+
+def _spectrogram(cache: SignalCache, n_pts: int =1024, n_overlap: int =0,
+        decimation_rate: int = 1, integration_interval: float = None,
+        integration_overlap: float = 0, stft_integration: bool = False,
+        frequency_limit: float = None, **kwargs) -> typing.Tuple[np.array, np.array, np.array]:
+    # pylint: disable=unused-argument
+
+    n_fft = n_pts * 2
+    if n_overlap < 1:
+        n_fft_overlap = np.floor(n_fft * n_overlap)
+    else:
+        n_fft_overlap = n_overlap * 2
+
+    hop_length = n_fft - int(n_fft_overlap)
+    window = _window(n_fft, cache.dtype)
+    scale = n_fft / 2 / np.sum(window)
+    n_bins = _band_end(_stft_frequencies(cache.fs/decimation_rate, n_fft), frequency_limit)
+
+    def compute():
+        data, fs = cache.get_decimated(decimation_rate, remove_mean=True)
+
+        power = stft(data, window, hop_length, first_bin=1, end_bin=n_bins + 1, scale=scale)
+        freq = _stft_frequencies(fs, n_fft)[:n_bins]
+        time = (np.arange(power.shape[1]) * hop_length + n_fft/2) / fs
+        return power, freq, time
+
+    def compute_integrated():
+        data, fs = cache.get_decimated(decimation_rate, remove_mean=True)
+
+        n_frames = 1 + (len(data) - n_fft) // hop_length
+        n_means, n_step = _integration_steps(hop_length/fs,
+                                             integration_interval, integration_overlap)
+
+        def frame_spectra(first_frame, end_frame):
+            return stft(data, window, hop_length, first_frame, end_frame, first_bin=1,
+                        end_bin=n_bins + 1, scale=scale)
+
+        power = _integrate_stft(frame_spectra, n_frames, n_means, n_step)
+        freq = _stft_frequencies(fs, n_fft)[:n_bins]
+        time = (np.arange(0, n_frames, n_step) * hop_length + n_fft/2) / fs
+        return power, freq, time
+
+    if stft_integration and integration_interval is not None:
+        return cache.get((Stage.STFT, 'spectrogram', decimation_rate, n_pts, n_overlap, n_bins,
+                          integration_interval, integration_overlap),
+                         cache.timed('stft', compute_integrated))
+
+    return cache.get((Stage.STFT, 'spectrogram', decimation_rate, n_pts, n_overlap, n_bins),
+                     cache.timed('stft', compute))
+
+def _log_spectrogram(cache: SignalCache, n_pts: int =1024, n_overlap: int =0,
+        decimation_rate: int = 1, **kwargs) -> typing.Tuple[np.array, np.array, np.array]:
+    # pylint: disable=unused-argument
+
+    def compute():
+        power, freq, time = _spectrogram(cache, n_pts, n_overlap, decimation_rate, **kwargs)
+        power = 20*np.log10(np.maximum(power, 1e-9))
+        return power, freq, time
+
+    key = ('log_spectrogram', decimation_rate, n_pts, n_overlap, kwargs.get('frequency_limit'))
+    if kwargs.get('stft_integration', False):
+        key += (kwargs.get('integration_interval', None), kwargs.get('integration_overlap', 0))
+
+    return cache.get(key, compute)
+
+def _lofar(cache: SignalCache, n_pts: int =1024, n_overlap: int =0,
+        decimation_rate: int = 1, **kwargs) -> typing.Tuple[np.array, np.array, np.array]:
+    # pylint: disable=unused-argument
+    freqs = _stft_frequencies(cache.fs/decimation_rate, n_pts * 2)
+    n_band = _band_end(freqs, kwargs.pop('frequency_limit', None))
+    n, p, n_bins = _tpsw_band(len(freqs), n_band)
+
+    power, freq, time = _log_spectrogram(cache, n_pts, n_overlap, decimation_rate,
+                                         frequency_limit = freqs[n_bins-1] \
+                                                if n_bins < len(freqs) else None,
+                                         **kwargs)
+    with cache.timer('tpsw'):
+        power = (power - tpsw(power, n=n, p=p))[:n_band]
+    power[power < -0.2] = 0
+    return power, freq[:n_band], time
+
+def _log_melgram(cache: SignalCache, n_pts: int =1024, n_overlap: int =0, n_mels: int = 256,
+        decimation_rate: int = 1, normalization: Normalization = Normalization.MIN_MAX_ZERO_CENTERED,
+        integration_interval: float = None, integration_overlap: float = 0,
+        stft_integration: bool = False, frequency_limit: float = None,
+        **kwargs) -> typing.Tuple[np.array, np.array, np.array]:
+    # pylint: disable=unused-argument
+    import librosa
+    n_fft=n_pts*2
+    n_fft_overlap = n_overlap * 2
+    hop_length=n_fft-n_fft_overlap
+    discard=int(np.floor(n_fft/hop_length))
+
+    if decimation_rate != 1:
+        fs = cache.fs/decimation_rate
+    else:
+        fs = cache.fs
+
+    def get_input():
+        if decimation_rate != 1:
+            data, _ = cache.get_decimated(decimation_rate, remove_mean=False)
+        else:
+            data = cache.data
+
+        return normalization(data).astype(cache.dtype)
+
+    window = _window(n_fft, cache.dtype)
+
+    fmax=fs/2
+    freqs = _mel_frequencies(n_mels, fmax)
+    filterbank = _mel_filterbank(fs, n_fft, n_mels, fmax)
+    n_bands, end_bin = _mel_band(filterbank, frequency_limit, freqs)
+
+    def compute_stft():
+        # same frames of librosa.stft, centered by padding with zeros
+        return stft(np.pad(get_input(), n_fft//2), window, hop_length, end_bin=end_bin, power=2)
+
+    def compute_integrated_stft():
+        data = np.pad(get_input(), n_fft//2)
+        n_frames = 1 + (len(data) - n_fft) // hop_length - discard
+        n_means, n_step = _integration_steps(hop_length/fs,
+                                             integration_interval, integration_overlap)
+
+        def frame_spectra(first_frame, end_frame):
+            return stft(data, window, hop_length, first_frame + discard, end_frame + discard,
+                        end_bin=end_bin, power=2)
+
+        return _integrate_stft(frame_spectra, n_frames, n_means, n_step)
+
+    if stft_integration and integration_interval is not None:
+        spectrum = cache.get((Stage.STFT, 'mel_stft', decimation_rate, n_pts, n_overlap,
+                              normalization, end_bin, integration_interval, integration_overlap),
+                             cache.timed('stft', compute_integrated_stft))
+    else:
+        spectrum = cache.get((Stage.STFT, 'mel_stft', decimation_rate, n_pts, n_overlap,
+                              normalization, end_bin), cache.timed('stft', compute_stft))
+
+    power = filterbank[:n_bands, :end_bin] @ spectrum
+    power = librosa.power_to_db(power, ref=np.max)
+    freqs = freqs[:n_bands]
+
+    start_time = n_pts/fs
+    step_time = (n_fft-n_fft_overlap)/fs
+
+    if stft_integration and integration_interval is not None:
+        _, n_step = _integration_steps(step_time, integration_interval, integration_overlap)
+        times = start_time + step_time * np.arange(0, power.shape[1] * n_step, n_step)
+        return power, freqs, times
+
+    power = power[:,discard:]
+    times = start_time + step_time * np.arange(power.shape[1])
+    return power, freqs, times
 
 def spectrogram(data: np.array, fs: float, n_pts: int =1024, n_overlap: int =0,
         decimation_rate: int = 1, **kwargs) -> typing.Tuple[np.array, np.array, np.array]:
@@ -192,30 +921,10 @@ def spectrogram(data: np.array, fs: float, n_pts: int =1024, n_overlap: int =0,
                 - 1D array with relative time to sample 0 of the data.
     """
     # pylint: disable=unused-argument
-
-    data = data - np.mean(data)
-
-    n_pts = n_pts * 2
-    if n_overlap < 1:
-        n_overlap = np.floor(n_pts * n_overlap)
-    else:
-        n_overlap = n_overlap * 2
-
-    data = decimate(data, decimation_rate)
-    fs = fs/decimation_rate
-
-    freq, time, power = sci.spectrogram(data,
-                                    nfft=n_pts,
-                                    fs=fs,
-                                    window=np.hanning(n_pts),
-                                    noverlap=n_overlap,
-                                    detrend=False,
-                                    scaling='spectrum',
-                                    mode='complex')
-    power = np.abs(power)*n_pts/2
-    power = power[1:,:]
-    freq = freq[1:]
-    return power, freq, time
+    engine = kwargs.get('decimation_engine', DecimationEngine.CHEBYSHEV)
+    cache = SignalCache(data, fs, engine, kwargs.get('dtype', np.float64))
+    return _spectrogram(cache, n_pts, n_overlap, decimation_rate,
+                        frequency_limit=kwargs.get('frequency_limit'))
 
 def log_spectrogram(data: np.array, fs: float, n_pts: int =1024, n_overlap: int =0,
         decimation_rate: int = 1, **kwargs) -> typing.Tuple[np.array, np.array, np.array]:
@@ -236,11 +945,10 @@ def log_spectrogram(data: np.array, fs: float, n_pts: int =1024, n_overlap: int
                 - 1D array with relative time to sample 0 of the data.
     """
     # pylint: disable=unused-argument
-    power, freq, time = spectrogram(data, fs, n_pts, n_overlap, decimation_rate)
-    power[power < 1e-9] = 1e-9
-    power = 20*np.log10(power)
-
-    return power, freq, time
+    engine = kwargs.get('decimation_engine', DecimationEngine.CHEBYSHEV)
+    cache = SignalCache(data, fs, engine, kwargs.get('dtype', np.float64))
+    return _log_spectrogram(cache, n_pts, n_overlap, decimation_rate,
+                        frequency_limit=kwargs.get('frequency_limit'))
 
 def lofar(data: np.array, fs: float, n_pts: int =1024, n_overlap: int =0,
         decimation_rate: int = 1, **kwargs) -> typing.Tuple[np.array, np.array, np.array]:
@@ -261,10 +969,10 @@ def lofar(data: np.array, fs: float, n_pts: int =1024, n_overlap: int =0,
                 - 1D array with relative time to sample 0 of the data.
     """
     # pylint: disable=unused-argument
-    power, freq, time = log_spectrogram(data, fs, n_pts, n_overlap, decimation_rate)
-    power = power - tpsw(power)
-    power[power < -0.2] = 0
-    return power, freq, time
+    engine = kwargs.get('decimation_engine', DecimationEngine.CHEBYSHEV)
+    cache = SignalCache(data, fs, engine, kwargs.get('dtype', np.float64))
+    return _lofar(cache, n_pts, n_overlap, decimation_rate,
+                        frequency_limit=kwargs.get('frequency_limit'))
 
 def log_melgram(data: np.array, fs: float, n_pts: int =1024, n_overlap: int =0, n_mels: int = 256,
         decimation_rate: int = 1, normalization: Normalization = Normalization.MIN_MAX_ZERO_CENTERED, **kwargs) -> typing.Tuple[np.array, np.array, np.array]:
@@ -286,33 +994,273 @@ def log_melgram(data: np.array, fs: float, n_pts: int =1024, n_overlap: int =0,
                 - 1D array with output frequencies.
                 - 1D array with relative time to sample 0 of the data.
         """
-    n_fft=n_pts*2
-    n_overlap *= 2
-    hop_length=n_fft-n_overlap
-    discard=int(np.floor(n_fft/hop_length))
+    engine = kwargs.get('decimation_engine', DecimationEngine.CHEBYSHEV)
+    cache = SignalCache(data, fs, engine, kwargs.get('dtype', np.float64))
+    return _log_melgram(cache, n_pts, n_overlap, n_mels, decimation_rate,
+                        normalization, frequency_limit=kwargs.get('frequency_limit'))
 
-    if decimation_rate != 1:
-        data = decimate(data, decimation_rate)
-        fs = fs/decimation_rate
+def _input_blocks(data: np.array, block_size: int, offset: float = 0,
+                  dtype: type = np.float64) -> typing.Iterator[np.array]:
+    """ Consecutive blocks of data as dtype, minus offset, reading only one block at a time. """
+    for first in range(0, len(data), block_size):
+        yield np.subtract(data[first:first + block_size], offset, dtype=dtype)
 
-    fmax=fs/2
-    n_data = normalization(data).astype(float)
-    power = librosa.feature.melspectrogram(
-                    y=n_data,
-                    sr=fs,
-                    n_fft=n_fft,
-                    hop_length=hop_length,
-                    win_length=n_fft,
-                    window=np.hanning(n_fft),
-                    n_mels=n_mels,
-                    power=2,
-                    fmax=fmax)
-    power = librosa.power_to_db(power, ref=np.max)
-    power = power[:,discard:]
+def _stream_mean(data: np.array, block_size: int) -> float:
+    """ Mean of data computed in blocks. """
+    total = 0
+    for block in _input_blocks(data, block_size):
+        total += np.sum(block)
+    return total / len(data)
 
-    freqs = librosa.core.mel_frequencies(n_mels=n_mels, fmin=0.0, fmax=fmax)
+def _spill(blocks: typing.Iterable[np.array], shape: typing.Tuple[int, ...],
+           axis: int = 0, dtype: type = np.float64) -> np.array:
+    """ Write consecutive blocks along axis to an anonymous temporary file, returning it as a
+    memory map, so that a result needed twice is kept on disk instead of in memory. """
+    spilled = np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=shape)
+    position = 0
+    for block in blocks:
+        index = [slice(None)] * len(shape)
+        index[axis] = slice(position, position + block.shape[axis])
+        spilled[tuple(index)] = block
+        position += block.shape[axis]
+    return spilled
 
-    start_time = n_pts/fs
-    step_time = (n_fft-n_overlap)/fs
-    times = [start_time + step_time * valor for valor in range(power.shape[1])]
-    return power, freqs, times
+def _normalization_affine(normalization: Normalization,
+                          blocks: typing.Iterable[np.array]) -> typing.Tuple[float, float]:
+    """ Offset and scale such that normalization(data) == (data - offset) * scale for 1D data
+    given in blocks, computed in one pass. """
+    if normalization == Normalization.NONE:
+        return 0, 1
+
+    n, mean, m2, total_abs = 0, 0.0, 0.0, 0.0
+    minimum, maximum = np.inf, -np.inf
+    for block in blocks:
+        # pairwise combination of the mean and the sum of squared deviations of each block
+        block_mean = np.mean(block)
+        block_m2 = np.sum((block - block_mean)**2)
+        delta = block_mean - mean
+        mean += delta * len(block) / (n + len(block))
+        m2 += block_m2 + delta**2 * n * len(block) / (n + len(block))
+        n += len(block)
+        total_abs += np.sum(np.abs(block))
+        minimum = min(minimum, np.min(block))
+        maximum = max(maximum, np.max(block))
+
+    if normalization == Normalization.MIN_MAX:
+        return minimum, 1 / (maximum - minimum)
+
+    if normalization == Normalization.MIN_MAX_ZERO_CENTERED:
+        return 0, 1 / max(abs(minimum), abs(maximum))
+
+    if normalization == Normalization.NORM_L1:
+        return 0, 1 / total_abs
+
+    if normalization == Normalization.NORM_L2:
+        # norm of (data - minimum)/(maximum - minimum)
+        norm = np.sqrt(m2 + n * (mean - minimum)**2) / (maximum - minimum)
+        return minimum, 1 / (maximum - minimum) / norm
+
+    raise UnboundLocalError(f"normalization {str(normalization)} not implemented")
+
+def _stream_frames(blocks: typing.Iterable[np.array], n_fft: int, hop_length: int,
+                   first_frame: int, end_frame: int,
+                   frames_per_block: int) -> typing.Iterator[np.array]:
+    """ STFT frames, one per row, from first_frame to end_frame of a signal given in consecutive
+    blocks, in groups of at most frames_per_block frames, keeping only the samples of the
+    frames not yet complete. """
+    buffer = np.zeros(0)
+    buffer_start = 0
+    frame = first_frame
+
+    for block in blocks:
+        n_drop = min(frame * hop_length - buffer_start, len(buffer))
+        buffer = np.concatenate([buffer[n_drop:], block])
+        buffer_start += n_drop
+
+        samples = buffer[frame * hop_length - buffer_start:]
+        n_complete = 1 + (len(samples) - n_fft) // hop_length if len(samples) >= n_fft else 0
+        base_frame = frame
+        last = min(frame + n_complete, end_frame)
+
+        while frame < last:
+            group_end = min(frame + frames_per_block, last)
+            yield _frames(samples, n_fft, hop_length, frame - base_frame, group_end - base_frame)
+            frame = group_end
+
+        if frame == end_frame:
+            return
+
+def _stream_integrate(blocks: typing.Iterable[np.array], n_means: int,
+                      n_step: int) -> typing.Iterator[np.array]:
+    """ Integrate spectra given in consecutive blocks of columns as _integrate_frames, yielding
+    each integration window as soon as its last spectrum is available. """
+    buffer = None
+    n_skip = 0
+    for block in blocks:
+        block = block[:, n_skip:]
+        n_skip -= min(n_skip, block.shape[1])
+        buffer = block if buffer is None else np.concatenate([buffer, block], axis=1)
+
+        n_complete = max(0, (buffer.shape[1] - n_means) // n_step + 1)
+        if n_complete == 0:
+            continue
+
+        yield _integrate_frames(buffer[:, :(n_complete - 1) * n_step + n_means],
+                                n_means, n_step)[:, :n_complete]
+
+        n_skip = max(0, n_complete * n_step - buffer.shape[1])
+        buffer = buffer[:, n_complete * n_step:]
+
+    if buffer is not None and buffer.shape[1] > 0:
+        yield _integrate_frames(buffer, n_means, n_step)
+
+def _n_integrated(n_frames: int, integration_interval: float, n_step: int) -> int:
+    return n_frames if integration_interval is None else len(range(0, n_frames, n_step))
+
+def stream(analysis: SpectralAnalysis, data: np.array, fs: float, n_pts: int = 1024,
+           n_overlap: int = 0, n_mels: int = 256, decimation_rate: int = 1,
+           decimation_engine: DecimationEngine = DecimationEngine.POLYPHASE,
+           integration_interval: float = None, integration_overlap: float = 0,
+           stft_integration: bool = False, dtype: type = np.float64,
+           frequency_limit: float = None, block_size: int = 2**20) \
+                -> typing.Tuple[typing.Iterator[np.array], np.array, np.array]:
+    """Perform spectral analysis in blocks, for recordings that do not fit in memory.
+
+    The data, that may be a memory map as scipy.io.wavfile.read(mmap=True), is read, decimated
+        and transformed in blocks, each spectrum being yielded as soon as its frame is available,
+        so the memory does not grow with the duration of the data. The results are the same of
+        SpectralAnalysis.apply_cached with the same decimation engine. The log mel spectrogram,
+        relative to its global maximum, is kept in a temporary file before being yielded.
+
+    Args:
+        analysis (SpectralAnalysis): Analysis to perform.
+        data (np.array): Input data for analysis.
+        fs (float): Sampling frequency.
+        n_pts, n_overlap, n_mels, decimation_rate, integration_interval, integration_overlap,
+            stft_integration, dtype, frequency_limit: Same as SpectralAnalysis.apply.
+        decimation_engine (DecimationEngine, optional): Method to decimate the data, must
+            support blocks (see DecimationEngine.apply_blocks).
+            Defaults to DecimationEngine.POLYPHASE.
+        block_size (int, optional): Number of samples of the decimated data processed at once.
+            Defaults to 2**20.
+
+    Returns:
+        typing.Tuple[typing.Iterator[np.array], np.array, np.array]: A tuple containing:
+            - Iterator over consecutive blocks of the power spectrum, one spectrum per column.
+            - 1D array with output frequencies.
+            - 1D array with relative time to sample 0 of the data.
+    """
+    n_fft = n_pts * 2
+    is_mel = analysis == SpectralAnalysis.LOG_MELGRAM
+    if is_mel or n_overlap >= 1:
+        hop_length = n_fft - n_overlap * 2
+    else:
+        hop_length = n_fft - int(np.floor(n_fft * n_overlap))
+    decimated_fs = fs / decimation_rate
+    step_time = hop_length / decimated_fs
+    frames_per_block = max(1, block_size // hop_length)
+
+    if integration_interval is not None:
+        n_means, n_step = _integration_steps(step_time, integration_interval, integration_overlap)
+    pre_integration = integration_interval is not None and stft_integration
+    post_integration = integration_interval is not None and not stft_integration
+
+    n_decimated = int(len(data) / decimation_rate)
+    window = _window(n_fft, dtype)
+
+    if is_mel:
+        discard = int(np.floor(n_fft/hop_length))
+        n_total = 1 + (n_decimated + 2 * (n_fft//2) - n_fft) // hop_length
+        n_frames = n_total - discard
+        first_frame = discard if pre_integration else 0
+        end_frame = n_total
+        freq = _mel_frequencies(n_mels, decimated_fs/2)
+        times = n_pts/decimated_fs + step_time * np.arange(n_frames)
+        mel_basis = _mel_filterbank(decimated_fs, n_fft, n_mels, decimated_fs/2)
+        n_bands, end_bin = _mel_band(mel_basis, frequency_limit, freq)
+        freq = freq[:n_bands]
+        mel_basis = mel_basis[:n_bands, :end_bin]
+
+        def signal():
+            if decimation_rate != 1:
+                decimated = _spill(decimation_engine.apply_blocks(data, decimation_rate,
+                                                                  block_size, dtype=dtype),
+                                   (n_decimated,), dtype=dtype)
+            else:
+                decimated = data
+            offset, scale = _normalization_affine(Normalization.MIN_MAX_ZERO_CENTERED,
+                                                  _input_blocks(decimated, block_size))
+            padding = np.zeros(n_fft//2, dtype=dtype)
+            return itertools.chain([padding], _input_blocks(decimated, block_size, offset, dtype),
+                                   [padding]), scale
+
+        def spectra(frames):
+            return _stft_frames(frames, window, end_bin=end_bin, power=2)
+
+    else:
+        n_frames = 1 + (n_decimated - n_fft) // hop_length
+        first_frame = 0
+        end_frame = n_frames
+        freq = _stft_frequencies(decimated_fs, n_fft)
+        times = (np.arange(n_frames) * hop_length + n_fft/2) / decimated_fs
+        scale = n_fft / 2 / np.sum(window)
+        n_band = _band_end(freq, frequency_limit)
+        n, p, n_bins = _tpsw_band(len(freq), n_band)
+        if analysis != SpectralAnalysis.LOFAR:
+            n_bins = n_band
+        freq = freq[:n_band]
+
+        def signal():
+            mean = _stream_mean(data, int(block_size * decimation_rate))
+            return decimation_engine.apply_blocks(data, decimation_rate, block_size, mean,
+                                                  dtype), 1
+
+        def spectra(frames):
+            return _stft_frames(frames, window, first_bin=1, end_bin=n_bins + 1, scale=scale)
+
+    def transform(power):
+        if analysis in [SpectralAnalysis.LOG_SPECTROGRAM, SpectralAnalysis.LOFAR]:
+            power = 20*np.log10(np.maximum(power, 1e-9))
+        if analysis == SpectralAnalysis.LOFAR:
+            power = (power - tpsw(power, n=n, p=p))[:n_band]
+            power[power < -0.2] = 0
+        return power
+
+    def blocks():
+        samples, input_scale = signal()
+        power_blocks = (spectra(frames * float(input_scale)) for frames in
+                        _stream_frames(samples, n_fft, hop_length, first_frame, end_frame,
+                                       frames_per_block))
+
+        if pre_integration:
+            power_blocks = _stream_integrate(power_blocks, n_means, n_step)
+
+        if is_mel:
+            import librosa
+            max_power = [0]
+            def mel_blocks():
+                for power in power_blocks:
+                    power = mel_basis @ power
+                    max_power[0] = max(max_power[0], np.max(power))
+                    yield power
+
+            n_spilled = _n_integrated(n_frames, integration_interval, n_step) \
+                            if pre_integration else n_total
+            spilled = _spill(mel_blocks(), (n_bands, n_spilled), axis=1, dtype=dtype)
+            first = 0 if pre_integration else discard
+            power_blocks = (np.maximum(librosa.power_to_db(spilled[:, i:i + frames_per_block],
+                                                           ref=max_power[0], top_db=None),
+                                       -80.0)
+                            for i in range(first, n_spilled, frames_per_block))
+        else:
+            power_blocks = (transform(power) for power in power_blocks)
+
+        if post_integration:
+            power_blocks = _stream_integrate(power_blocks, n_means, n_step)
+
+        yield from power_blocks
+
+    if integration_interval is not None:
+        times = times[::n_step]
+
+    return blocks(), freq, times
@@ -0,0 +1,535 @@
+"""
+Cache Module
+
+This module bounds the disk usage of a data_processed_base_dir. Every AudioFileProcessor
+configuration creates its own directory there, so the processed data of old configurations
+accumulates. The AudioFileProcessor records each access to its processed files in an access log in
+its directory, and the CacheManager uses these logs to evict, or demote to a compressed tier, the
+least recently used files when the directory exceeds a byte budget.
+"""
+import os
+import json
+import time
+import shutil
+import typing
+import threading
+import multiprocessing.util
+
+import pandas as pd
+
+import iara.processing.storage as iara_storage
+
+
+ACCESS_LOG = 'access.log'
+STAGES_DIR = 'stages'
+
+# the accesses are kept in memory and appended to the logs once per interval or number of
+# accesses, and a log larger than the limit is compacted to one line per file
+ACCESS_FLUSH_INTERVAL = 30
+ACCESS_FLUSH_SIZE = 16
+ACCESS_LOG_LIMIT = 1 << 20
+
+_access_lock = threading.Lock()
+_pending_accesses: typing.Dict[str, typing.List[str]] = {}
+_n_pending = 0
+_last_flush = time.time()
+_exit_flush_pid = None
+
+
+def record_access(output_dir: str, file_id: int, hit: bool) -> None:
+    """
+    Record an access to the processed data of a file in the access log of a processor directory.
+
+    Each access is one line, (time, file_id, hits, misses). The lines are buffered and appended
+        by flush_access_log with a single write per directory, so several processes can record
+        accesses to the same directory. The buffer is flushed every ACCESS_FLUSH_INTERVAL seconds
+        or ACCESS_FLUSH_SIZE accesses and when the process exits, including multiprocessing
+        workers. A miss, that has just written the processed data, is flushed at once, so the
+        files processed by workers that are killed are still logged.
+
+    Parameters:
+        output_dir (str): Directory of the processor configuration.
+        file_id (int): ID of the file.
+        hit (bool): If True, the processed data was available, otherwise it was processed.
+    """
+    global _n_pending, _exit_flush_pid
+    line = f'{time.time():.3f} {file_id} {int(hit)} {int(not hit)}\n'
+    with _access_lock:
+        if _exit_flush_pid != os.getpid():
+            # multiprocessing workers exit without atexit, only running the finalizers
+            # registered after they started
+            _exit_flush_pid = os.getpid()
+            multiprocessing.util.Finalize(None, flush_access_log, exitpriority=0)
+
+        _pending_accesses.setdefault(output_dir, []).append(line)
+        _n_pending += 1
+        flush = not hit or _n_pending >= ACCESS_FLUSH_SIZE or \
+                time.time() - _last_flush >= ACCESS_FLUSH_INTERVAL
+    if flush:
+        flush_access_log()
+
+def flush_access_log(output_dir: str = None) -> None:
+    """
+    Append the buffered accesses to the access logs, compacting the logs above ACCESS_LOG_LIMIT.
+
+    The accesses are discarded when the log can not be written, as in a read-only directory.
+
+    Parameters:
+        output_dir (str, optional): Directory of the processor configuration.
+            Defaults to all directories with buffered accesses.
+    """
+    global _n_pending, _last_flush
+    with _access_lock:
+        if output_dir is None:
+            pending = dict(_pending_accesses)
+            _pending_accesses.clear()
+            _last_flush = time.time()
+        else:
+            pending = {output_dir: _pending_accesses.pop(output_dir, [])}
+        _n_pending = sum(len(lines) for lines in _pending_accesses.values())
+
+    for directory, lines in pending.items():
+        if len(lines) == 0:
+            continue
+        filename = os.path.join(directory, ACCESS_LOG)
+        try:
+            with open(filename, 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+            if os.path.getsize(filename) > ACCESS_LOG_LIMIT:
+                compact_access_log(directory)
+        except OSError:
+            pass
+
+def _clear_pending_accesses() -> None:
+    # a forked process must not log again the accesses buffered by its parent
+    global _n_pending
+    with _access_lock:
+        _pending_accesses.clear()
+        _n_pending = 0
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_clear_pending_accesses)
+
+def read_access_log(output_dir: str) -> typing.Dict[int, typing.Tuple[float, int, int]]:
+    """
+    Read the access log of a processor directory.
+
+    Parameters:
+        output_dir (str): Directory of the processor configuration.
+
+    Returns:
+        Dict[int, Tuple[float, int, int]]: The last access time, number of hits and number of
+            misses of each file.
+    """
+    flush_access_log(output_dir)
+
+    accesses = {}
+    filename = os.path.join(output_dir, ACCESS_LOG)
+    if not os.path.exists(filename):
+        return accesses
+
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                access_time, file_id, hits, misses = line.split()
+                access_time, file_id = float(access_time), int(file_id)
+                hits, misses = int(hits), int(misses)
+            except ValueError:
+                # incomplete line of an interrupted write
+                continue
+
+            last, total_hits, total_misses = accesses.get(file_id, (0, 0, 0))
+            accesses[file_id] = (max(last, access_time), total_hits + hits, total_misses + misses)
+
+    return accesses
+
+def compact_access_log(output_dir: str, file_ids: typing.Iterable[int] = None) -> None:
+    """
+    Rewrite the access log of a processor directory with one line per file.
+
+    Parameters:
+        output_dir (str): Directory of the processor configuration.
+        file_ids (Iterable[int], optional): Files to keep in the log. Defaults to all.
+    """
+    accesses = read_access_log(output_dir)
+    if file_ids is not None:
+        file_ids = set(file_ids)
+        accesses = {file_id: access for file_id, access in accesses.items()
+                    if file_id in file_ids}
+
+    filename = os.path.join(output_dir, ACCESS_LOG)
+    with open(filename + '.tmp', 'w', encoding='utf-8') as f:
+        for file_id, (access_time, hits, misses) in sorted(accesses.items()):
+            f.write(f'{access_time:.3f} {file_id} {hits} {misses}\n')
+    os.replace(filename + '.tmp', filename)
+
+
+class CacheEntry():
+    """ One evictable unit of a data_processed_base_dir: a processed file or a whole store. """
+
+    def __init__(self,
+                 directory: str,
+                 storage: iara_storage.BaseStorage,
+                 file_id: typing.Optional[int],
+                 size: int,
+                 last_access: float,
+                 compressed: bool = False) -> None:
+        """
+        Parameters:
+            directory (str): Directory of the processor configuration, or of the stage key.
+            storage (iara_storage.BaseStorage): Storage keeping the data, None for stages.
+            file_id (Optional[int]): ID of the file, None when the entry is the whole storage.
+            size (int): Size in bytes.
+            last_access (float): Time of the last access, in seconds since the epoch.
+            compressed (bool): If True, the entry is in the compressed tier.
+        """
+        self.directory = directory
+        self.storage = storage
+        self.file_id = file_id
+        self.size = size
+        self.last_access = last_access
+        self.compressed = compressed
+
+    def remove(self) -> None:
+        """ Remove the data of the entry. """
+        if self.storage is None:
+            os.remove(os.path.join(self.directory, f'{self.file_id}.pkl'))
+        elif self.file_id is None:
+            self.storage.clear()
+        else:
+            self.storage.remove(self.file_id)
+
+    def demote(self) -> typing.Optional['CacheEntry']:
+        """
+        Move the data of the entry to the compressed tier of its directory.
+
+        Returns:
+            Optional[CacheEntry]: The entry in the compressed tier, or None when the file was
+                already there, demoted from another storage of the same directory.
+        """
+        compressed = iara_storage.CompressedStorage(self.directory)
+        if compressed.exists(self.file_id):
+            self.storage.remove(self.file_id)
+            return None
+
+        power, times = self.storage.load(self.file_id)
+        compressed.save(self.file_id, power, times)
+        del power
+        self.storage.remove(self.file_id)
+        return CacheEntry(self.directory, compressed, self.file_id,
+                          compressed.get_size(self.file_id), self.last_access, compressed=True)
+
+    def is_demotable(self) -> bool:
+        """ Check if the entry can be moved to the compressed tier. """
+        return not self.compressed and self.storage is not None and self.file_id is not None
+
+    def __str__(self) -> str:
+        name = 'all files' if self.file_id is None else f'file {self.file_id}'
+        tier = ' (compressed)' if self.compressed else ''
+        return f'{os.path.basename(self.directory)} {name}{tier}'
+
+
+class CacheManager():
+    """
+    Keeps the size of a data_processed_base_dir under a byte budget, evicting the least recently
+        used processed files, in all processor directories and in the stage store.
+
+    The last access of each file comes from the access log of its processor directory, or from
+        its modification time when it was never accessed through an AudioFileProcessor. Files of
+        a ConsolidatedStorage can only be removed together, as one entry accessed when any of
+        its files was. Directories left without processed data by an eviction are removed.
+
+    The CacheManager is meant to run while no processor is writing to the directory.
+    """
+
+    def __init__(self, data_processed_base_dir: str, budget: int, demote: bool = False) -> None:
+        """
+        Parameters:
+            data_processed_base_dir (str): Base directory for process data.
+            budget (int): Maximum size in bytes of the processed data.
+            demote (bool): If True, the least recently used files are first moved to a zlib
+                compressed tier, reloaded and promoted back on the next access, and only removed
+                when the compressed data still exceeds the budget. Default is False
+        """
+        self.data_processed_base_dir = data_processed_base_dir
+        self.budget = budget
+        self.demote = demote
+
+    def _get_processor_dirs(self) -> typing.List[str]:
+        if not os.path.isdir(self.data_processed_base_dir):
+            return []
+        return [os.path.join(self.data_processed_base_dir, name)
+                for name in sorted(os.listdir(self.data_processed_base_dir))
+                if name != STAGES_DIR and
+                    os.path.isdir(os.path.join(self.data_processed_base_dir, name))]
+
+    @staticmethod
+    def _get_storages(directory: str) -> typing.List[iara_storage.BaseStorage]:
+        return [storage_type.build(directory) for storage_type in iara_storage.StorageType] + \
+                [iara_storage.CompressedStorage(directory)]
+
+    def _get_processor_entries(self, directory: str) -> typing.List[CacheEntry]:
+        accesses = read_access_log(directory)
+
+        def last_access(file_id: int, filename: str) -> float:
+            if file_id in accesses:
+                return accesses[file_id][0]
+            return os.path.getmtime(filename)
+
+        entries = []
+        for storage in CacheManager._get_storages(directory):
+            file_ids = storage.get_file_ids()
+            if not file_ids:
+                continue
+
+            compressed = isinstance(storage, iara_storage.CompressedStorage)
+            if storage.SINGLE_FILE_REMOVAL:
+                for file_id in file_ids:
+                    entries.append(CacheEntry(directory, storage, file_id,
+                                              storage.get_size(file_id),
+                                              last_access(file_id,
+                                                          storage._get_filename(file_id)),
+                                              compressed))
+            else:
+                entries.append(CacheEntry(directory, storage, None,
+                                          sum(storage.get_size(file_id) for file_id in file_ids),
+                                          max(last_access(file_id, storage.filename)
+                                              for file_id in file_ids)))
+        return entries
+
+    def _get_stage_entries(self) -> typing.List[CacheEntry]:
+        stages_dir = os.path.join(self.data_processed_base_dir, STAGES_DIR)
+        if not os.path.isdir(stages_dir):
+            return []
+
+        entries = []
+        for name in os.listdir(stages_dir):
+            entries.extend(self._get_stage_dir_entries(os.path.join(stages_dir, name)))
+        return entries
+
+    @staticmethod
+    def _get_stage_dir_entries(directory: str) -> typing.List[CacheEntry]:
+        entries = []
+        for file in os.listdir(directory):
+            file_id, extension = os.path.splitext(file)
+            if extension == '.pkl':
+                filename = os.path.join(directory, file)
+                entries.append(CacheEntry(directory, None, int(file_id),
+                                          os.path.getsize(filename),
+                                          os.path.getmtime(filename)))
+        return entries
+
+    def get_entries(self) -> typing.List[CacheEntry]:
+        """
+        Get all evictable entries of the data_processed_base_dir.
+
+        Returns:
+            List[CacheEntry]: The entries, from the least to the most recently used.
+        """
+        entries = self._get_stage_entries()
+        for directory in self._get_processor_dirs():
+            entries.extend(self._get_processor_entries(directory))
+        return sorted(entries, key=lambda entry: entry.last_access)
+
+    def get_size(self) -> int:
+        """ Get the total size in bytes of the processed data. """
+        return sum(entry.size for entry in self.get_entries())
+
+    def evict(self, dry_run: bool = False, verbose: bool = False) -> typing.List[str]:
+        """
+        Evict, or demote, the least recently used entries until the processed data fits in the
+            budget.
+
+        Parameters:
+            dry_run (bool): If True, only list the actions, without changing any file.
+                Default is False
+            verbose (bool): If True, print each action. Default is False
+
+        Returns:
+            List[str]: The description of the actions, in the order they were taken.
+        """
+        entries = self.get_entries()
+        total = sum(entry.size for entry in entries)
+        actions = []
+        evicted_dirs = set()
+
+        def log(action: str) -> None:
+            actions.append(action)
+            if verbose:
+                print(action)
+
+        if self.demote:
+            for i, entry in enumerate(entries):
+                if total <= self.budget:
+                    break
+                if not entry.is_demotable():
+                    continue
+
+                if dry_run:
+                    log(f'demote {entry}')
+                    continue
+
+                entries[i] = entry.demote()
+                new_size = 0 if entries[i] is None else entries[i].size
+                total -= entry.size - new_size
+                log(f'demote {entry}: {entry.size} -> {new_size} bytes')
+
+        for entry in entries:
+            if total <= self.budget:
+                break
+            if entry is None:
+                continue
+
+            if not dry_run:
+                entry.remove()
+                evicted_dirs.add(entry.directory)
+            total -= entry.size
+            log(f'evict {entry}: {entry.size} bytes')
+
+        if not dry_run:
+            self._clean_directories(evicted_dirs)
+
+        return actions
+
+    def _clean_directories(self, directories: typing.Set[str]) -> None:
+        """ Remove the evicted directories left without data and the accesses of evicted files. """
+        for directory in self._get_processor_dirs():
+            if directory not in directories:
+                continue
+
+            file_ids = set()
+            for storage in CacheManager._get_storages(directory):
+                file_ids.update(storage.get_file_ids())
+
+            if not file_ids:
+                shutil.rmtree(directory)
+            elif os.path.exists(os.path.join(directory, ACCESS_LOG)):
+                compact_access_log(directory, file_ids)
+
+        stages_dir = os.path.join(self.data_processed_base_dir, STAGES_DIR)
+        if os.path.isdir(stages_dir):
+            for name in os.listdir(stages_dir):
+                directory = os.path.join(stages_dir, name)
+                if directory in directories and \
+                        not any(file.endswith('.pkl') for file in os.listdir(directory)):
+                    shutil.rmtree(directory)
+
+    def validate(self, repair: bool = False, min_tmp_age: float = 3600,
+                 verbose: bool = False) -> typing.List[str]:
+        """
+        Check all processed files, in all tiers and in the stage store, for files that cannot be
+            loaded, incomplete chunks of consolidated stores and temporary files left by
+            interrupted writes.
+
+        Parameters:
+            repair (bool): If True, remove the invalid files, to be processed again on the next
+                access, truncate the incomplete chunks and remove the temporary files. Each file
+                is repaired holding its lock. Default is False
+            min_tmp_age (float): Minimum age in seconds of the temporary files to be considered
+                abandoned, younger ones may belong to running writes. Default is 3600
+            verbose (bool): If True, print each problem. Default is False
+
+        Returns:
+            List[str]: The description of the problems found.
+        """
+        problems = []
+
+        def log(problem: str) -> None:
+            problems.append(problem)
+            if verbose:
+                print(problem)
+
+        def check_tmp_files(files: typing.Iterable[str]) -> None:
+            for file in files:
+                try:
+                    if time.time() - os.path.getmtime(file) >= min_tmp_age:
+                        log(f'temporary file {file}')
+                        if repair:
+                            os.remove(file)
+                except FileNotFoundError:
+                    # renamed or removed by its write meanwhile
+                    pass
+
+        for directory in self._get_processor_dirs():
+            for storage in CacheManager._get_storages(directory):
+                for file_id in storage.get_file_ids():
+                    if storage.validate(file_id):
+                        continue
+                    log(f'invalid {storage.__class__.__name__} {os.path.basename(directory)} '
+                        f'file {file_id}')
+                    if repair:
+                        with storage.file_lock(file_id):
+                            storage.remove(file_id)
+
+                if isinstance(storage, iara_storage.ConsolidatedStorage) and \
+                        storage.get_incomplete_size() != 0:
+                    log(f'incomplete chunk in {storage.filename}: '
+                        f'{storage.get_incomplete_size()} bytes')
+                    if repair:
+                        storage.repair()
+
+            check_tmp_files(iara_storage.get_tmp_files(directory))
+            check_tmp_files(iara_storage.get_tmp_files(
+                    iara_storage.CompressedStorage(directory).output_dir))
+
+        stages_dir = os.path.join(self.data_processed_base_dir, STAGES_DIR)
+        if os.path.isdir(stages_dir):
+            for name in os.listdir(stages_dir):
+                directory = os.path.join(stages_dir, name)
+                for entry in self._get_stage_dir_entries(directory):
+                    filename = os.path.join(directory, f'{entry.file_id}.pkl')
+                    try:
+                        pd.read_pickle(filename)
+                    except Exception: # pylint: disable=broad-except
+                        log(f'invalid stage {filename}')
+                        if repair:
+                            entry.remove()
+                check_tmp_files(iara_storage.get_tmp_files(directory))
+
+        return problems
+
+    def report(self) -> pd.DataFrame:
+        """
+        Summarize the usage of the data_processed_base_dir by processor configuration.
+
+        Returns:
+            pd.DataFrame: One row per processor directory, and one for the stage store, with the
+                analysis, the number of files and their size, in each tier, the hits and misses
+                of the access log and the last access, from the most to the least recently used.
+        """
+        rows = []
+        for directory in self._get_processor_dirs():
+            analysis = None
+            config_file = os.path.join(directory, 'config.json')
+            if os.path.exists(config_file):
+                with open(config_file, 'r', encoding='utf-8') as f:
+                    analysis = json.load(f).get('analysis')
+
+            entries = self._get_processor_entries(directory)
+            accesses = read_access_log(directory).values()
+            rows.append(self._report_row(os.path.basename(directory), analysis, entries,
+                                         sum(access[1] for access in accesses),
+                                         sum(access[2] for access in accesses)))
+
+        entries = self._get_stage_entries()
+        if entries:
+            rows.append(self._report_row(STAGES_DIR, None, entries, None, None))
+
+        columns = ['directory', 'analysis', 'n_files', 'size', 'n_compressed', 'compressed_size',
+                   'hits', 'misses', 'last_access']
+        df = pd.DataFrame(rows, columns=columns)
+        df['last_access'] = pd.to_datetime(df['last_access'], unit='s')
+        return df.sort_values('last_access', ascending=False, ignore_index=True)
+
+    @staticmethod
+    def _report_row(directory: str, analysis: str, entries: typing.List[CacheEntry],
+                    hits: int, misses: int) -> typing.List:
+        stored = [entry for entry in entries if not entry.compressed]
+        compressed = [entry for entry in entries if entry.compressed]
+        n_files = sum(len(entry.storage.get_file_ids()) if entry.file_id is None else 1
+                      for entry in stored)
+        return [directory, analysis,
+                n_files, sum(entry.size for entry in stored),
+                len(compressed), sum(entry.size for entry in compressed),
+                hits, misses,
+                max((entry.last_access for entry in entries), default=None)]
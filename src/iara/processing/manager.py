@@ -10,18 +10,23 @@ import enum
 import typing
 import tqdm
 import json
+import time
 import hashlib
+import threading
+import contextlib
+import concurrent.futures as concurrent
 
-import PIL
 import pandas as pd
 import numpy as np
-import scipy.io.wavfile as scipy_wav
-import matplotlib.pyplot as plt
-import matplotlib.colors as color
-import tikzplotlib as tikz
+
+# scipy.io.wavfile, matplotlib, tikzplotlib and PIL are imported where used, so the workers
+# reading processed data do not load them
 
 import iara.utils as iara_utils
+import iara.records
 import iara.processing.analysis as iara_proc
+import iara.processing.storage as iara_storage
+import iara.processing.cache as iara_cache
 import iara.processing.prefered_numbers as iara_pn
 
 
@@ -48,6 +53,63 @@ class PlotType(enum.Enum):
     def __str__(self):
         return str(self.name).rsplit('_', maxsplit=1)[-1].lower()
 
+class ProcessingStats():
+    """
+    Counters and timers of the processing and cache accesses of an AudioFileProcessor, shared by
+        all threads using it.
+
+    The timers are exclusive: the time of a step timed inside another one (e.g. decimate inside
+        stft) is only counted in the inner step, so the times of all steps add up to the total.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        """ Zero all counters and timers. """
+        with self.lock:
+            self.counters = {}
+            self.times = {}
+            self.calls = {}
+
+    def count(self, name: str, value: int = 1) -> None:
+        """ Add value to the counter name. """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, name: str) -> typing.Iterator[None]:
+        """ Context adding its duration, except the time of nested timers, to the timer name. """
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self.lock:
+                self.times[name] = self.times.get(name, 0) + elapsed - nested
+                self.calls[name] = self.calls.get(name, 0) + 1
+
+    def to_dict(self) -> typing.Dict:
+        """
+        Returns:
+            Dict: With 'counters', the value of each counter, and 'timers', the total seconds and
+                number of calls of each timer.
+        """
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'timers': {name: {'seconds': seconds, 'calls': self.calls[name]}
+                           for name, seconds in self.times.items()},
+            }
+
+
 class AudioFileProcessor():
     """ Class for handling acess to process data from a dataset. """
 
@@ -60,10 +122,19 @@ class AudioFileProcessor():
                 n_overlap: int = 0,
                 n_mels: int = 256,
                 decimation_rate: int = 1,
+                decimation_engine: iara_proc.DecimationEngine = \
+                        iara_proc.DecimationEngine.CHEBYSHEV,
                 extract_id: typing.Callable[[str], int] = get_iara_id,
                 frequency_limit: float = None,
                 integration_overlap=0,
-                integration_interval=None
+                integration_interval=None,
+                stft_integration: bool = False,
+                streaming: bool = False,
+                dtype: type = np.float64,
+                storage_type: iara_storage.StorageType = iara_storage.StorageType.PICKLE,
+                cached_stages: typing.Iterable[iara_proc.Stage] = (),
+                codec: iara_storage.Codec = iara_storage.Codec.NONE,
+                normalize_after_frequency_limit: bool = False
                 ) -> None:
         """
         Parameters:
@@ -75,11 +146,60 @@ class AudioFileProcessor():
             n_overlap (int): Number of points to overlap for use in analysis.
             n_mels (int): Number of Mel frequency bins for use in analysis.
             decimation_rate (int): Decimation rate for use in analysis when mel based.
+            decimation_engine (iara_proc.DecimationEngine): Method to decimate the data.
+                Default is DecimationEngine.CHEBYSHEV
             extract_id (Callable[[str], str]): Function to extract ID from a file name without
                 extension. Default is split based on '-' em get last part of the name
             frequency_limit (float): The frequency limit to be considered in the data
                 processing result. Default is fs/2
+            integration_overlap (float): Overlap in seconds between integration windows.
+                Default is 0
+            integration_interval (float): Duration in seconds to average consecutive spectra.
+                Default is None(no integration)
+            stft_integration (bool): If True, the integration is done while computing the STFT,
+                before the analysis specific transforms (log, TPSW, mel), never holding the
+                full resolution spectrogram in memory. Default is False
+            streaming (bool): If True, the raw file is memory-mapped and processed in blocks,
+                each block being written to the storage as it is computed, so the memory does not
+                grow with the duration of the file (see iara_proc.stream). Requires a decimation
+                engine that works in blocks, as DecimationEngine.POLYPHASE, and a storage that
+                writes in blocks, StorageType.NUMPY without codec or StorageType.CONSOLIDATED.
+                The result is the same, so it does not change the hash. Default is False
+            dtype (type): Floating point type of the processing, from the raw data to the stored
+                data, np.float32 or np.float64. np.float32 halves the memory and the pickle
+                storage size. Default is np.float64
+            storage_type (iara_storage.StorageType): Format to keep the processed data in
+                data_processed_base_dir. Default is StorageType.PICKLE
+            cached_stages (Iterable[iara_proc.Stage]): Intermediate results kept in the 'stages'
+                directory of data_processed_base_dir, shared with other processors, so that
+                processing a file in a new configuration restarts from the deepest stage it
+                shares with a previous one (e.g. a new normalization reuses the transform and a
+                new n_mels reuses the STFT). Costs disk space, so it does not change the hash and
+                is not used in streaming. Default is () (no stage kept)
+            codec (iara_storage.Codec): Encoding of the processed data in the storage, as float16,
+                quantized to uint8/uint16 or lossless compressed, decoded when loaded. The lossy
+                codecs change the data, so the codec is part of the hash. Not available in
+                StorageType.CONSOLIDATED. Default is Codec.NONE
+            normalize_after_frequency_limit (bool): If True, only the frequencies up to
+                frequency_limit are computed and the normalization (and the dB reference of the
+                mel analysis) is done over them, which is faster for low limits but changes the
+                data, so it is part of the hash. Otherwise the whole spectrum is normalized
+                before the limit, as in the first release. Default is False
+
+        Raises:
+            ValueError: If streaming is requested with a decimation engine or a storage that
+                can not work in blocks.
         """
+        if streaming:
+            if decimation_engine != iara_proc.DecimationEngine.POLYPHASE:
+                raise ValueError(f'streaming requires a decimation engine that works in blocks, '
+                                 f'not {str(decimation_engine)}')
+            # the other storages concatenate the blocks before saving
+            if storage_type == iara_storage.StorageType.PICKLE or \
+                    codec != iara_storage.Codec.NONE:
+                raise ValueError(f'streaming requires a storage that writes in blocks, '
+                                 f'not {str(storage_type)} with codec {str(codec)}')
+
         self.data_base_dir = data_base_dir
         self.data_processed_base_dir = data_processed_base_dir
         self.normalization = normalization
@@ -88,13 +208,48 @@ class AudioFileProcessor():
         self.n_overlap = n_overlap
         self.n_mels = n_mels
         self.decimation_rate = decimation_rate
+        self.decimation_engine = decimation_engine
         self.extract_id = extract_id
         self.frequency_limit = frequency_limit
         self.integration_overlap = integration_overlap
         self.integration_interval = integration_interval
+        self.stft_integration = stft_integration
+        self.streaming = streaming
+        self.dtype = dtype
+        self.storage_type = storage_type
+        self.cached_stages = tuple(cached_stages)
+        self.codec = codec
+        self.normalize_after_frequency_limit = normalize_after_frequency_limit
 
+        self._init_runtime_state()
         self._check_dir()
 
+    def _init_runtime_state(self) -> None:
+        """ Initializes the attributes that are not part of the processor configuration. """
+        self._raw_index = None
+        self._raw_misses = set()
+        self._storage = None
+        self._lock = threading.RLock()
+        self._stats = ProcessingStats()
+
+    def __getstate__(self) -> typing.Dict:
+        state = self.__dict__.copy()
+        for key in ['_raw_index', '_raw_misses', '_storage', '_lock', '_stats']:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state: typing.Dict) -> None:
+        state.setdefault('decimation_engine', iara_proc.DecimationEngine.CHEBYSHEV)
+        state.setdefault('stft_integration', False)
+        state.setdefault('streaming', False)
+        state.setdefault('dtype', np.float64)
+        state.setdefault('storage_type', iara_storage.StorageType.PICKLE)
+        state.setdefault('cached_stages', ())
+        state.setdefault('codec', iara_storage.Codec.NONE)
+        state.setdefault('normalize_after_frequency_limit', False)
+        self.__dict__.update(state)
+        self._init_runtime_state()
+
     def _get_output_dir(self) -> str:
         return os.path.join(self.data_processed_base_dir,
                                   str(self.analysis) + "_" + self._get_hash())
@@ -105,7 +260,7 @@ class AudioFileProcessor():
         return hash_obj.hexdigest()
 
     def _to_dict(self) -> typing.Dict:
-        return {
+        config = {
             'data_base_dir': self.data_base_dir,
             'data_processed_base_dir': self.data_processed_base_dir,
             'normalization': str(self.normalization),
@@ -118,21 +273,108 @@ class AudioFileProcessor():
             'integration_overlap': self.integration_overlap,
             'integration_interval': self.integration_interval,
         }
+        # options added after the first release only enter the dict when changed from the
+        # default, keeping the hash of existing processed directories
+        if self.decimation_engine != iara_proc.DecimationEngine.CHEBYSHEV:
+            config['decimation_engine'] = str(self.decimation_engine)
+        if self.stft_integration:
+            config['stft_integration'] = self.stft_integration
+        if np.dtype(self.dtype) != np.float64:
+            config['dtype'] = np.dtype(self.dtype).name
+        if self.codec != iara_storage.Codec.NONE:
+            config['codec'] = str(self.codec)
+        if self.frequency_limit and self.normalize_after_frequency_limit:
+            config['normalize_after_frequency_limit'] = True
+        return config
 
     def _save(self, path: str = None):
         config_file = os.path.join(self._get_output_dir() if path is None else path, "config.json")
-        with open(config_file, "w", encoding="utf-8") as f:
-            json.dump(self._to_dict(), f, indent=4)
+        with iara_storage.atomic_write(config_file) as filename:
+            with open(filename, "w", encoding="utf-8") as f:
+                json.dump(self._to_dict(), f, indent=4)
 
     def _check_dir(self) -> None:
         if not os.path.exists(self._get_output_dir()):
             os.makedirs(self._get_output_dir(), exist_ok=True)
             self._save()
 
+    def _get_raw_index_file(self) -> str:
+        return os.path.join(self._get_output_dir(), "raw_index.json")
+
+    def _scan_raw_files(self) -> typing.Dict:
+        """
+        Walks over data_base_dir mapping all raw files by ID.
+
+        Returns:
+            Dict: With 'files', the ID to path map, and 'dirs', the modification time of each
+                visited directory, used to detect changes in the file list.
+        """
+        files_map = {}
+        dirs = {}
+        for root, _, files in os.walk(self.data_base_dir):
+            dirs[root] = os.stat(root).st_mtime
+            for file in sorted(files):
+                filename, extension = os.path.splitext(file)
+                if extension == ".wav":
+                    files_map.setdefault(self.extract_id(filename), os.path.join(root, file))
+
+        return {'data_base_dir': self.data_base_dir, 'dirs': dirs, 'files': files_map}
+
+    @staticmethod
+    def _is_raw_index_updated(raw_index: typing.Dict) -> bool:
+        for directory, mtime in raw_index['dirs'].items():
+            try:
+                if os.stat(directory).st_mtime != mtime:
+                    return False
+            except FileNotFoundError:
+                return False
+        return True
+
+    def _load_raw_index(self, rebuild: bool = False) -> typing.Dict:
+        """
+        Loads the ID to path map of the raw files, building it only when the saved one is missing
+            or outdated in relation to data_base_dir.
+
+        Parameters:
+            rebuild (bool): If True, ignore the saved map and scan data_base_dir again.
+
+        Returns:
+            Dict: The raw index, see _scan_raw_files, with the map from file ID to the path of
+                the raw file in 'files'.
+        """
+        index_file = self._get_raw_index_file()
+        raw_index = None
+
+        if not rebuild and os.path.exists(index_file):
+            try:
+                with open(index_file, "r", encoding="utf-8") as f:
+                    raw_index = json.load(f)
+                raw_index['files'] = {int(key): value for key, value in raw_index['files'].items()}
+
+                if raw_index['data_base_dir'] != self.data_base_dir or \
+                        not AudioFileProcessor._is_raw_index_updated(raw_index):
+                    raw_index = None
+
+            except (ValueError, KeyError):
+                raw_index = None
+
+        if raw_index is None:
+            raw_index = self._scan_raw_files()
+            os.makedirs(self._get_output_dir(), exist_ok=True)
+            with iara_storage.atomic_write(index_file) as filename:
+                with open(filename, "w", encoding="utf-8") as f:
+                    json.dump(raw_index, f, indent=4)
+
+        return raw_index
+
     def _find_raw_file(self, file_id: int) -> str:
         """
         Finds the raw file associated with the given ID.
 
+        The ID to path map is built once per processor and kept in raw_index.json, next to the
+            config.json. The first failed lookup rebuilds it, later ones only when a directory of
+            data_base_dir changed since that scan, failing immediately otherwise.
+
         Parameters:
             file_id (int): The ID to search for.
 
@@ -142,72 +384,319 @@ class AudioFileProcessor():
         Raises:
             UnboundLocalError: If the file is not found.
         """
-        for root, _, files in os.walk(self.data_base_dir):
-            for file in files:
-                filename, extension = os.path.splitext(file)
-                if extension == ".wav" and self.extract_id(filename) == file_id:
-                    return os.path.join(root, file)
-        raise UnboundLocalError(f'file {file_id} not found in {self.data_base_dir}')
+        with self._lock:
+            if self._raw_index is None:
+                self._raw_index = self._load_raw_index()
 
-    def _process(self, file_id: int) -> typing.Tuple[np.array, np.array, np.array]:
+            file = self._raw_index['files'].get(file_id)
+            if file is None or not os.path.exists(file):
+                # rescan once for the misses of an index, then only when data_base_dir changes
+                file = None
+                if len(self._raw_misses) == 0 or \
+                        not AudioFileProcessor._is_raw_index_updated(self._raw_index):
+                    self._raw_index = self._load_raw_index(rebuild=True)
+                    self._raw_misses = set()
+                    file = self._raw_index['files'].get(file_id)
+
+                if file is None:
+                    self._raw_misses.add(file_id)
+
+        if file is None:
+            raise UnboundLocalError(f'file {file_id} not found in {self.data_base_dir}')
+        return file
+
+    def _read(self, file_id: int, mmap: bool = False) -> typing.Tuple[float, np.array]:
+        """
+        Read the first channel of the raw file associated with the given ID.
+
+        Parameters:
+            file_id (int): The ID of the file.
+            mmap (bool): If True, the samples are memory-mapped instead of loaded. Default: False.
 
+        Returns:
+            Tuple[float, np.array]: The sampling frequency and the samples.
+        """
+        import scipy.io.wavfile as scipy_wav
         file = self._find_raw_file(file_id = file_id)
 
-        fs, data = scipy_wav.read(file)
+        with self._stats.timer('read'):
+            fs, data = scipy_wav.read(file, mmap=mmap)
+
+        if not mmap:
+            self._stats.count('raw_bytes_read', data.nbytes)
 
         if data.ndim != 1:
             data = data[:,0]
 
-        power, freqs, times = self.analysis.apply(data = data,
+        return fs, data
+
+    def get_duration(self, file_id: int) -> float:
+        """ Get the duration in seconds of the raw file associated with the given ID. """
+        fs, data = self._read(file_id, mmap=True)
+        return len(data)/fs
+
+    def _get_signal_cache(self, file_id: int) -> iara_proc.SignalCache:
+        """
+        Build the SignalCache of a file, backed by the stage store when cached_stages is set. In
+            this case the raw file is memory-mapped, being read only if a stage is missing.
+
+        Parameters:
+            file_id (int): ID of the file.
+
+        Returns:
+            iara_proc.SignalCache: The cache over the raw data of the file.
+        """
+        if not self.cached_stages:
+            fs, data = self._read(file_id)
+            return iara_proc.SignalCache(data, fs, self.decimation_engine, self.dtype,
+                                         stats = self._stats)
+
+        fs, data = self._read(file_id, mmap=True)
+        stage_store = iara_storage.StageStore(
+                os.path.join(self.data_processed_base_dir, 'stages'),
+                self.data_base_dir,
+                file_id)
+        return iara_proc.SignalCache(data, fs, self.decimation_engine, self.dtype,
+                                     stage_store = stage_store,
+                                     stages = self.cached_stages,
+                                     stats = self._stats)
+
+    def _process(self, file_id: int) -> typing.Tuple[np.array, np.array, np.array]:
+        return self._process_cache(self._get_signal_cache(file_id))
+
+    def _process_cache(self, cache: iara_proc.SignalCache) \
+            -> typing.Tuple[np.array, np.array, np.array]:
+
+        # the cache may be shared with other processors, see process_multiple
+        cache.stats = self._stats
+
+        power, freqs, times = self.analysis.apply_cached(cache = cache,
+                                                  n_pts = self.n_pts,
+                                                  n_overlap = self.n_overlap,
+                                                  n_mels = self.n_mels,
+                                                  decimation_rate = self.decimation_rate,
+                                                  integration_overlap = self.integration_overlap,
+                                                  integration_interval = self.integration_interval,
+                                                  stft_integration = self.stft_integration,
+                                                  frequency_limit = self._get_band_limit())
+
+        with self._stats.timer('normalize'):
+            power = self.normalization(power)
+
+        index_limit = self._get_frequency_limit_index(freqs)
+        return power[:index_limit,:], freqs[:index_limit], times
+
+    def _get_band_limit(self) -> typing.Optional[float]:
+        """ Frequency limit of the analysis, None when the whole spectrum is normalized before
+        the limit. """
+        return self.frequency_limit if self.normalize_after_frequency_limit else None
+
+    def _get_frequency_limit_index(self, freqs: np.array) -> int:
+        if not self.frequency_limit:
+            return len(freqs)
+        return next((i for i, freq in enumerate(freqs) if freq > self.frequency_limit), len(freqs))
+
+    def _process_stream(self, file_id: int) \
+            -> typing.Tuple[typing.Iterator[np.array], np.array, np.array]:
+        """
+        Process a file in blocks over the memory-mapped raw file, see iara_proc.stream.
+
+        Parameters:
+            file_id (int): ID of the file.
+
+        Returns:
+            Tuple[Iterator[np.array], np.array, np.array]: Iterator over blocks of consecutive
+                windows, one window per row, the frequencies and the time of each window.
+        """
+        fs, data = self._read(file_id, mmap=True)
+
+        blocks, freqs, times = self.analysis.apply_stream(data = data,
                                                   fs = fs,
                                                   n_pts = self.n_pts,
                                                   n_overlap = self.n_overlap,
                                                   n_mels = self.n_mels,
                                                   decimation_rate = self.decimation_rate,
+                                                  decimation_engine = self.decimation_engine,
                                                   integration_overlap = self.integration_overlap,
-                                                  integration_interval = self.integration_interval)
+                                                  integration_interval = self.integration_interval,
+                                                  stft_integration = self.stft_integration,
+                                                  dtype = self.dtype,
+                                                  frequency_limit = self._get_band_limit())
 
-        power = self.normalization(power)
+        index_limit = self._get_frequency_limit_index(freqs)
 
-        if self.frequency_limit:
-            index_limit = next((i for i, freq in enumerate(freqs)
-                                if freq > self.frequency_limit), len(freqs))
-            freqs = freqs[:index_limit]
-            power = power[:index_limit,:]
+        def rows():
+            for power in blocks:
+                with self._stats.timer('normalize'):
+                    power = self.normalization(power)[:index_limit,:].T
+                yield power
 
-        return power, freqs, times
+        return rows(), freqs[:index_limit], times
 
-    def get_data(self, file_id: int) -> typing.Tuple[pd.DataFrame, np.array]:
+    def _get_storage(self) -> iara_storage.BaseStorage:
+        with self._lock:
+            if self._storage is None:
+                self._storage = self.storage_type.build(self._get_output_dir(), self.codec)
+            return self._storage
+
+    def is_cached(self, file_id: int) -> bool:
+        """ Check if the processed data of a file is already available in the storage, or in its
+        compressed tier. """
+        return self._get_storage().exists(file_id) or \
+                iara_storage.CompressedStorage(self._get_output_dir()).exists(file_id)
+
+    def get_array(self, file_id: int, start_time: float = None, end_time: float = None) \
+            -> typing.Tuple[np.array, np.array]:
+        """
+        Get the processed data of a file, processing and storing it if not available yet.
 
+        The processing holds the lock of the file in the storage, so threads and processes
+            sharing the storage process each file once, the others waiting for its result.
+
+        Parameters:
+            file_id (int): ID of the file.
+            start_time (float): Only windows with time >= start_time are returned, read without
+                the others in the NUMPY and CONSOLIDATED storages. Default: None, from the first.
+            end_time (float): Only windows with time <= end_time are returned. Default: None,
+                to the last.
+
+        Returns:
+            Tuple[np.array, np.array]: 2D array with one window per row and one frequency per
+                column, and the time of each window.
+        """
         os.makedirs(self._get_output_dir(), exist_ok=True)
-        filename = os.path.join(self._get_output_dir(), f'{file_id}.pkl')
+        storage = self._get_storage()
+        time_range = (start_time, end_time)
+
+        if storage.exists(file_id):
+            return self._load_file(storage, file_id, time_range, hit=True)
+
+        with storage.file_lock(file_id):
+            if storage.exists(file_id):
+                # processed by another worker while waiting for the lock
+                return self._load_file(storage, file_id, time_range, hit=True)
+
+            compressed = iara_storage.CompressedStorage(self._get_output_dir())
+            if compressed.exists(file_id):
+                # demoted by the CacheManager, promoted back on access
+                power, times = self._load_file(compressed, file_id, hit=True)
+                self._save_file(storage, file_id, power, times)
+                compressed.remove(file_id)
+                return self._load_file(storage, file_id, time_range)
+
+            iara_cache.record_access(self._get_output_dir(), file_id, hit=False)
+            self._stats.count('misses')
+
+            if self.streaming:
+                blocks, freqs, times = self._process_stream(file_id)
+                # the processing runs as the blocks are written
+                with self._stats.timer('stream'):
+                    storage.save_blocks(file_id, blocks, times, len(freqs))
+                self._stats.count('bytes_written', storage.get_size(file_id))
+                return self._load_file(storage, file_id, time_range)
+
+            power, _, times = self._process(file_id)
+
+            self._save_file(storage, file_id, power.T, times)
+
+        if self.storage_type == iara_storage.StorageType.PICKLE and \
+                self.codec == iara_storage.Codec.NONE:
+            rows = iara_storage.time_range_slice(times, start_time, end_time)
+            return power.T[rows], times[rows]
+
+        return self._load_file(storage, file_id, time_range)
+
+    def _load_file(self, storage: iara_storage.BaseStorage, file_id: int,
+                   time_range: typing.Tuple[float, float] = (None, None), hit: bool = None) \
+            -> typing.Tuple[np.array, np.array]:
+        """ Load a file, or the windows in time_range, from storage, recording it as a hit or a
+        miss, if given, in the access log and in the stats. """
+        if hit is not None:
+            iara_cache.record_access(self._get_output_dir(), file_id, hit=hit)
+            self._stats.count('hits' if hit else 'misses')
 
-        if os.path.exists(filename):
-            data = pd.read_pickle(filename)
-            return data['df'], data['times']
+        with self._stats.timer('load'):
+            if time_range == (None, None):
+                power, times = storage.load(file_id)
+                self._stats.count('bytes_read', storage.get_size(file_id))
+            else:
+                power, times = storage.load_range(file_id, *time_range)
+                self._stats.count('bytes_read', power.nbytes + times.nbytes)
+        return power, times
 
-        power, freqs, times = self._process(file_id)
+    def _save_file(self, storage: iara_storage.BaseStorage, file_id: int, power: np.array,
+                   times: np.array) -> None:
+        """ Save a file in storage, recording it in the stats. """
+        with self._stats.timer('serialize'):
+            storage.save(file_id, power, times)
+        self._stats.count('bytes_written', storage.get_size(file_id))
 
-        columns = [f'f {i}' for i in range(len(freqs))]
-        df = pd.DataFrame(power.T, columns=columns)
-        df.to_pickle(filename)
+    def _store(self, file_id: int, power: np.array, times: np.array) -> None:
+        """ Store data processed outside get_array, unless another worker already stored it. """
+        storage = self._get_storage()
+        with storage.file_lock(file_id):
+            if not storage.exists(file_id):
+                self._save_file(storage, file_id, power, times)
 
-        data_to_save = {'df': df, 'times': times}
-        pd.to_pickle(data_to_save, filename)
+    def get_stats(self) -> typing.Dict:
+        """
+        Get the counters and timers of the processing in this process since the processor
+            creation or the last reset_stats, see ProcessingStats.
+
+        Counters: hits and misses of the processed data, bytes_read and bytes_written of the
+            processed data, raw_bytes_read of the raw files and stage_hits and stage_misses of
+            the stage store.
+        Timers: read, decimate, stft, analysis, tpsw, integrate, normalize, serialize, load,
+            stage_load, stage_save and, in streaming, stream for the pipeline run as the blocks
+            are written.
+
+        Returns:
+            Dict: The stats, see ProcessingStats.to_dict.
+        """
+        return self._stats.to_dict()
 
-        return df, times
+    def reset_stats(self) -> None:
+        """ Zero the counters and timers of get_stats. """
+        self._stats.reset()
+
+    def get_data(self, file_id: int, start_time: float = None, end_time: float = None) \
+            -> typing.Tuple[pd.DataFrame, np.array]:
+        """
+        Get the processed data of a file as a DataFrame, see get_array.
+
+        Parameters:
+            file_id (int): ID of the file.
+            start_time (float): Only windows with time >= start_time are returned.
+                Default: None, from the first.
+            end_time (float): Only windows with time <= end_time are returned.
+                Default: None, to the last.
+
+        Returns:
+            Tuple[pd.DataFrame, np.array]: The processed data, one window per row, and the time
+                of each window.
+        """
+        power, times = self.get_array(file_id, start_time, end_time)
+        return iara_storage.to_df(power), times
 
     def get_complete_df(self,
                file_ids: typing.Iterable[int],
-               targets: typing.Iterable) -> typing.Tuple[pd.DataFrame, pd.Series]:
+               targets: typing.Iterable,
+               n_workers: int = None) -> typing.Tuple[pd.DataFrame, pd.Series]:
         """
         Retrieve data for the given file IDs.
 
+        The number of windows of each file is read from the storage first, processing the files
+            not available yet, so the data of all files is loaded directly into one preallocated
+            array, wrapped by the returned DataFrame without copies. In storages that load the
+            file to get its shape, as StorageType.PICKLE, the data is kept from this pass and
+            concatenated instead, reading each file once.
+
         Parameters:
             - file_ids (Iterable[int]): The list of IDs to fetch data for;
                 a pd.Series of ints can be passed as well.
             - targets (Iterable): List of target values corresponding to the file IDs.
                 Should have the same number of elements as file_ids.
+            - n_workers (int): Number of threads loading the files. Default is os.cpu_count().
 
         Returns:
             Tuple[pd.DataFrame, pd.Series]:
@@ -215,52 +704,119 @@ class AudioFileProcessor():
                 - pd.Series: The Series containing the target values,
                     with the same type as the target input.
         """
-        result_df = pd.DataFrame()
-        result_target = pd.Series()
+        file_ids = list(file_ids)
+        targets = list(targets)
+        n_workers = os.cpu_count() if n_workers is None else n_workers
+
+        if len(file_ids) == 0:
+            return pd.DataFrame(), pd.Series(name='Target')
+
+        storage = self._get_storage()
+
+        def get_shape(file_id: int) -> typing.Tuple[int, int]:
+            if not storage.exists(file_id):
+                self.get_array(file_id)
+            return storage.get_shape(file_id)
+
+        def get_power(file_id: int) -> np.array:
+            return self.get_array(file_id)[0]
+
+        with concurrent.ThreadPoolExecutor(max_workers=n_workers) as executor:
+            if not storage.SHAPE_WITHOUT_LOAD:
+                powers = list(tqdm.tqdm(executor.map(get_power, file_ids), total=len(file_ids),
+                                        desc='Get data', leave=False, ncols=120))
+                n_rows = [len(power) for power in powers]
+                result = np.concatenate(powers)
+                del powers
+            else:
+                shapes = list(tqdm.tqdm(executor.map(get_shape, file_ids), total=len(file_ids),
+                                        desc='Get shapes', leave=False, ncols=120))
+
+                n_rows = [shape[0] for shape in shapes]
+                offsets = np.concatenate([[0], np.cumsum(n_rows)])
+
+                first = get_power(file_ids[0])
+                result = np.empty((offsets[-1], first.shape[1]), dtype=first.dtype)
+                result[:n_rows[0]] = first
+                del first
+
+                def fill(index: int) -> None:
+                    result[offsets[index]:offsets[index + 1]] = get_power(file_ids[index])
 
-        for local_id, target in tqdm.tqdm(
-                                list(zip(file_ids, targets)), desc='Get data', leave=False, ncols=120):
-            data_df, _ = self.get_data(local_id)
-            result_df = pd.concat([result_df, data_df], ignore_index=True)
+                futures = [executor.submit(fill, index) for index in range(1, len(file_ids))]
+                for future in tqdm.tqdm(concurrent.as_completed(futures), total=len(futures),
+                                        desc='Get data', leave=False, ncols=120):
+                    future.result()
 
-            replicated_targets = pd.Series([target] * len(data_df), name='Target')
-            result_target = pd.concat([result_target, replicated_targets], ignore_index=True)
+        result_target = pd.Series(np.repeat(np.array(targets, dtype=object), n_rows),
+                                  name='Target').infer_objects()
 
-        return result_df, result_target
+        return iara_storage.to_df(result), result_target
 
     def plot(self,
              file_id: typing.Union[int, typing.Iterable[int]],
              plot_type: PlotType = PlotType.EXPORT_PLOT,
              frequency_in_x_axis: bool=False,
-             colormap: color.Colormap = plt.get_cmap('jet'),
-             override: bool = False) -> None:
+             colormap: 'matplotlib.colors.Colormap' = None,
+             override: bool = False,
+             n_workers: int = None) -> None:
         """
         Display or save images with processed data.
 
+        The data is read from the storage, processing and storing the files not available yet.
+            EXPORT_RAW images are colored through a lookup table of the colormap and written
+            directly to png, without pyplot. For a list of IDs, EXPORT_RAW files are exported in
+            a thread pool and EXPORT_PLOT/EXPORT_TEX files in a process pool on the non
+            interactive agg backend, so the extract_id function must be picklable.
+
         Parameters:
             file_id (Union[int, Iterable[int]]): ID or list of IDs of the file to plot.
             plot_type (PlotType): Type of plot to generate (default: PlotType.EXPORT_PLOT).
             frequency_in_x_axis (bool): If True, plot frequency values on the x-axis.
                 Default: False.
-            colormap (Colormap): Colormap to use for the plot. Default: 'jet'.
+            colormap (Colormap): Colormap to use for the plot. Default: None, 'jet'.
             override (bool): If True, override any existing saved plots. Default: False.
+            n_workers (int): Number of workers exporting a list of IDs. Default is os.cpu_count().
 
         Returns:
             None
         """
+        import matplotlib
+        colormap = matplotlib.colormaps['jet'] if colormap is None else colormap
+
         if plot_type != PlotType.SHOW_FIGURE:
             output_dir = os.path.join(self._get_output_dir(), str(plot_type))
             os.makedirs(output_dir, exist_ok=True)
             self._save()
 
         if not isinstance(file_id, int):
-            for local_id in tqdm.tqdm(file_id, desc='Plot', leave=False, ncols=120):
-                self.plot(
-                    file_id = local_id,
-                    plot_type = plot_type,
-                    frequency_in_x_axis = frequency_in_x_axis,
-                    colormap = colormap,
-                    override = override)
+            if plot_type == PlotType.SHOW_FIGURE:
+                for local_id in tqdm.tqdm(file_id, desc='Plot', leave=False, ncols=120):
+                    self.plot(
+                        file_id = local_id,
+                        plot_type = plot_type,
+                        frequency_in_x_axis = frequency_in_x_axis,
+                        colormap = colormap,
+                        override = override)
+                return
+
+            n_workers = os.cpu_count() if n_workers is None else n_workers
+            if plot_type == PlotType.EXPORT_RAW:
+                executor = concurrent.ThreadPoolExecutor(max_workers=n_workers)
+            else:
+                import matplotlib.pyplot as plt
+                executor = concurrent.ProcessPoolExecutor(max_workers=n_workers,
+                                                          initializer=plt.switch_backend,
+                                                          initargs=('agg',))
+
+            with executor:
+                futures = [executor.submit(self.plot, local_id, plot_type, frequency_in_x_axis,
+                                           colormap, override)
+                           for local_id in file_id]
+
+                for future in tqdm.tqdm(concurrent.as_completed(futures), total=len(futures),
+                                        desc='Plot', leave=False, ncols=120):
+                    future.result()
             return
 
         if plot_type == PlotType.EXPORT_RAW or plot_type == PlotType.EXPORT_PLOT:
@@ -273,18 +829,24 @@ class AudioFileProcessor():
         if os.path.exists(filename) and not override:
             return
 
-        power, freqs, times = self._process(file_id)
+        power, times = self.get_array(file_id)
+        times = np.array(times)
 
-        if frequency_in_x_axis:
+        if not frequency_in_x_axis:
             power = power.T
 
         if plot_type == PlotType.EXPORT_RAW:
-            power = colormap(power)
-            power_color = (power * 255).astype(np.uint8)
-            image = PIL.Image.fromarray(power_color)
-            image.save(filename)
+            import PIL.Image
+            image = PIL.Image.fromarray(_to_rgba(power, colormap))
+            with iara_storage.atomic_write(filename, '.png') as tmp_filename:
+                image.save(tmp_filename)
             return
 
+        import matplotlib.pyplot as plt
+
+        # the frequencies are computed without processing the data, as in streaming
+        _, freqs, _ = self._process_stream(file_id)
+
         times[0] = 0
         freqs[0] = 0
 
@@ -323,13 +885,142 @@ class AudioFileProcessor():
         if plot_type == PlotType.SHOW_FIGURE:
             plt.show()
         elif plot_type == PlotType.EXPORT_PLOT:
-            plt.savefig(filename)
+            with iara_storage.atomic_write(filename, '.png') as tmp_filename:
+                plt.savefig(tmp_filename)
             plt.close()
         elif plot_type == PlotType.EXPORT_TEX:
-            tikz.save(filename)
+            import tikzplotlib as tikz
+            with iara_storage.atomic_write(filename, '.tex') as tmp_filename:
+                tikz.save(tmp_filename)
             plt.close()
 
     def __eq__(self, other: object) -> bool:
         if isinstance(other, AudioFileProcessor):
             return self._get_hash() == other._get_hash()
         return False
+
+
+def _to_rgba(power: np.array, colormap: 'matplotlib.colors.Colormap') -> np.array:
+    """ RGBA image of power, equal to (colormap(power) * 255).astype(np.uint8), through a lookup
+    table with the colors of the colormap and its under, over and bad colors. """
+    n_colors = colormap.N
+    lut = np.vstack([colormap.get_under(), colormap(np.arange(n_colors)), colormap.get_over(),
+                     colormap.get_bad()])
+    lut = (lut * 255).astype(np.uint8)
+
+    indexes = power * n_colors
+    indexes[indexes == n_colors] = n_colors - 1
+    indexes = np.clip(np.floor(indexes), -1, n_colors) + 1
+    indexes[np.isnan(indexes)] = n_colors + 2
+    return lut[indexes.astype(np.intp)]
+
+def process_multiple(processors: typing.Iterable[AudioFileProcessor], file_id: int) \
+        -> typing.List[typing.Tuple[np.array, np.array, np.array]]:
+    """
+    Process a file for several processor configurations at once.
+
+    The raw file is read, channel selected and decimated once for all processors sharing it, the
+        decimation engine and the dtype, and
+        the STFT is computed once for each n_pts/n_overlap, deriving all features from it.
+
+    Parameters:
+        processors (Iterable[AudioFileProcessor]): Processors configurations.
+        file_id (int): ID of the file.
+
+    Returns:
+        List[Tuple[np.array, np.array, np.array]]: The power, frequencies and times for each
+            processor, as AudioFileProcessor._process.
+    """
+    caches = {}
+    results = []
+    for processor in processors:
+        key = (processor._find_raw_file(file_id), processor.decimation_engine,
+               np.dtype(processor.dtype), processor.data_processed_base_dir,
+               processor.cached_stages)
+        if key not in caches:
+            caches[key] = processor._get_signal_cache(file_id)
+        results.append(processor._process_cache(caches[key]))
+    return results
+
+def get_data_multiple(processors: typing.Iterable[AudioFileProcessor], file_id: int) -> None:
+    """
+    Store the processed data of a file for all processors that do not have it yet, processing
+        it once for all of them with process_multiple.
+
+    Parameters:
+        processors (Iterable[AudioFileProcessor]): Processors configurations.
+        file_id (int): ID of the file.
+    """
+    processors = [processor for processor in processors if not processor.is_cached(file_id)]
+    for processor, (power, _, times) in zip(processors, process_multiple(processors, file_id)):
+        processor._store(file_id, power.T, times)
+
+def _precompute_file(processors: typing.List[AudioFileProcessor], file_id: int) \
+        -> typing.Tuple[typing.List[typing.Tuple[np.array, np.array]], float]:
+    """ Process a file in a worker process, returning the data to be stored and its duration. """
+    results = [(power.T, times) for power, _, times in process_multiple(processors, file_id)]
+    return results, processors[0].get_duration(file_id)
+
+def precompute(collection: typing.Union[iara.records.CustomCollection, iara.records.Collection],
+               processors: typing.Union[AudioFileProcessor, typing.Iterable[AudioFileProcessor]],
+               n_workers: int = None) -> typing.Dict:
+    """
+    Fill the processed data storage of one or more processors for all files in a collection.
+
+    Files are processed in a process pool, each file once for all processors as in
+        process_multiple, already stored files are skipped and all writes are done in the calling
+        process. The extract_id function of the processors must be picklable, i.e. defined at
+        module level.
+
+    Parameters:
+        collection (Union[CustomCollection, Collection]): Collection with the files to process.
+        processors (Union[AudioFileProcessor, Iterable[AudioFileProcessor]]): Processors
+            configurations to fill.
+        n_workers (int): Number of worker processes. Default is os.cpu_count().
+
+    Returns:
+        Dict: Throughput report, with the number of processed and skipped files, the elapsed
+            time in seconds, files/s and audio-hours/s, counting each file once per processor.
+    """
+    if isinstance(processors, AudioFileProcessor):
+        processors = [processors]
+
+    file_ids = collection.to_df()['ID'].to_list()
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+
+    tasks = {}
+    for file_id in file_ids:
+        pending = [processor for processor in processors if not processor.is_cached(file_id)]
+        if len(pending) != 0:
+            tasks[file_id] = pending
+
+    n_processed = sum(len(pending) for pending in tasks.values())
+    start_time = time.time()
+    audio_seconds = 0
+
+    with concurrent.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(_precompute_file, pending, file_id): file_id
+                   for file_id, pending in tasks.items()}
+
+        for future in tqdm.tqdm(concurrent.as_completed(futures), total=len(futures),
+                                desc='Precomputing', leave=False, ncols=120):
+            file_id = futures[future]
+            results, duration = future.result()
+            for processor, (power, times) in zip(tasks[file_id], results):
+                processor._store(file_id, power, times)
+            audio_seconds += duration * len(results)
+
+    elapsed = time.time() - start_time
+    report = {
+        'processed': n_processed,
+        'skipped': len(file_ids) * len(processors) - n_processed,
+        'elapsed': elapsed,
+        'files/s': n_processed / elapsed if elapsed > 0 else 0,
+        'audio-hours/s': audio_seconds / 3600 / elapsed if elapsed > 0 else 0,
+    }
+
+    print(f"{report['processed']} files processed and {report['skipped']} skipped in "
+          f"{iara_utils.str_format_time(elapsed)}: {report['files/s']:.2f} files/s, "
+          f"{report['audio-hours/s']:.4f} audio-hours/s")
+
+    return report
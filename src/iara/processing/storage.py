@@ -0,0 +1,879 @@
+"""
+Storage Module
+
+This module defines the formats available to keep the processed data of each audio file in the
+processed data directory of an AudioFileProcessor.
+
+All writes are atomic, to a temporary file renamed over the final one, so a crashed writer never
+leaves a truncated file, and FileLock serializes the processing of each file between the threads
+and processes sharing a directory.
+"""
+import os
+import abc
+import enum
+import zlib
+import shutil
+import typing
+import hashlib
+import threading
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, where FileLock only excludes the threads of a process
+    fcntl = None
+
+
+def to_df(power: np.array) -> pd.DataFrame:
+    """
+    Wraps a processed power matrix in the DataFrame format returned by the storages.
+
+    Parameters:
+        power (np.array): 2D array with one window per row and one frequency per column.
+
+    Returns:
+        pd.DataFrame: DataFrame with one 'f {i}' column per frequency, without copying the data
+            when possible.
+    """
+    columns = [f'f {i}' for i in range(power.shape[1])]
+    return pd.DataFrame(power, columns=columns, copy=False)
+
+
+def time_range_slice(times: np.array, start_time: float = None, end_time: float = None) -> slice:
+    """
+    Get the rows of the windows with start_time <= time <= end_time.
+
+    Parameters:
+        times (np.array): Increasing time of each window, may be a memory map, as only about
+            log2(len(times)) values are read.
+        start_time (float): First time of the range. Default is None, from the first window.
+        end_time (float): Last time of the range. Default is None, to the last window.
+
+    Returns:
+        slice: The slice of the rows in the range.
+    """
+    start = 0 if start_time is None else int(np.searchsorted(times, start_time, side='left'))
+    end = len(times) if end_time is None else int(np.searchsorted(times, end_time, side='right'))
+    return slice(start, max(start, end))
+
+
+TMP_SUFFIX = '.tmp'
+
+@contextlib.contextmanager
+def atomic_write(filename: str, extension: str = '') -> typing.Iterator[str]:
+    """
+    Context to write a file atomically: the file is written to the yielded temporary path, in
+        the same directory, and renamed to filename only when the context exits without errors.
+
+    Parameters:
+        filename (str): Path of the file.
+        extension (str): Extension of the temporary path, for writers that append one to paths
+            without it (e.g. '.npy' for np.save). Default is ''
+
+    Yields:
+        str: The temporary path to write.
+    """
+    tmp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}{extension}'
+    try:
+        yield tmp_filename
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+def get_tmp_files(directory: str) -> typing.List[str]:
+    """ Get the temporary files of atomic_write in a directory, left by interrupted writes or
+    belonging to running ones. """
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, file) for file in os.listdir(directory) if TMP_SUFFIX in file]
+
+
+class FileLock():
+    """
+    Exclusive advisory lock, between threads and processes, over a lock file. The lock is
+        reentrant in the thread holding it.
+
+    A lock held by a process is released by the system if it crashes, so an abandoned lock file
+        never blocks the others.
+    """
+    _states = {}
+    _states_lock = threading.Lock()
+
+    class _State():
+        def __init__(self) -> None:
+            self.thread_lock = threading.RLock()
+            self.count = 0
+            self.file = None
+
+    def __init__(self, filename: str) -> None:
+        """
+        Parameters:
+            filename (str): Path of the lock file, created if needed.
+        """
+        self.filename = filename
+        with FileLock._states_lock:
+            self.state = FileLock._states.setdefault(os.path.abspath(filename), FileLock._State())
+
+    def acquire(self) -> None:
+        """ Wait for the lock. """
+        self.state.thread_lock.acquire()
+        if self.state.count == 0 and fcntl is not None:
+            try:
+                os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+                self.state.file = open(self.filename, 'a', encoding='utf-8')
+                fcntl.flock(self.state.file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                if self.state.file is not None:
+                    self.state.file.close()
+                    self.state.file = None
+                self.state.thread_lock.release()
+                raise
+        self.state.count += 1
+
+    def release(self) -> None:
+        """ Release the lock. """
+        self.state.count -= 1
+        if self.state.count == 0 and self.state.file is not None:
+            fcntl.flock(self.state.file.fileno(), fcntl.LOCK_UN)
+            self.state.file.close()
+            self.state.file = None
+        self.state.thread_lock.release()
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release()
+
+
+# values kept in the highest codes of the quantized codecs, from the highest code down
+_RESERVED_VALUES = (np.nan, np.inf, -np.inf)
+
+
+class Codec(enum.Enum):
+    """
+    Enum defining the encodings of the processed data in the storages.
+
+        NONE: Data as processed (PICKLE) or as float32 (NUMPY, CONSOLIDATED).
+        FLOAT16: Data as float16, decoded to float32.
+        UINT8, UINT16: Data linearly quantized between the minimum and the maximum of each file,
+            decoded to float32. The NaN and infinite values are kept in the three highest codes,
+            reserved only in the files that have them.
+        LOSSLESS: Data zlib compressed after grouping the bytes of the same significance of all
+            values, decoded to the processed type.
+    """
+    NONE = 0
+    FLOAT16 = 1
+    UINT8 = 2
+    UINT16 = 3
+    LOSSLESS = 4
+
+    def __str__(self):
+        return str(self.name).rsplit('.', maxsplit=1)[-1].lower()
+
+    def encode(self, power: np.array) -> typing.Tuple[np.array, np.array]:
+        """
+        Encode the processed data of a file.
+
+        Parameters:
+            power (np.array): 2D array with one window per row and one frequency per column.
+
+        Returns:
+            Tuple[np.array, np.array]: The encoded data and the float64 parameters to decode it.
+        """
+        if self == Codec.NONE:
+            return power, np.zeros(0)
+
+        if self == Codec.FLOAT16:
+            return power.astype(np.float16), np.zeros(0)
+
+        if self in [Codec.UINT8, Codec.UINT16]:
+            dtype = np.uint8 if self == Codec.UINT8 else np.uint16
+            finite = np.isfinite(power)
+            n_reserved = 0 if finite.all() else len(_RESERVED_VALUES)
+            offset = float(np.min(power, where=finite, initial=np.inf))
+            offset = offset if np.isfinite(offset) else 0.0
+            maximum = float(np.max(power, where=finite, initial=offset))
+            scale = (maximum - offset) / (np.iinfo(dtype).max - n_reserved)
+            scale = scale if scale > 0 else 1.0
+            quantized = np.rint((power - offset) * (1 / scale))
+            if n_reserved == 0:
+                return quantized.astype(dtype), np.array([offset, scale])
+
+            for code, value in zip(range(np.iinfo(dtype).max, 0, -1), _RESERVED_VALUES):
+                quantized[np.isnan(power) if np.isnan(value) else power == value] = code
+            return quantized.astype(dtype), np.array([offset, scale, n_reserved])
+
+        if self == Codec.LOSSLESS:
+            power = np.ascontiguousarray(power)
+            itemsize = power.dtype.itemsize
+            shuffled = power.view(np.uint8).reshape(-1, itemsize).T
+            data = np.frombuffer(zlib.compress(shuffled.tobytes()), dtype=np.uint8)
+            return data, np.array([power.shape[0], power.shape[1], itemsize], dtype=np.float64)
+
+        raise UnboundLocalError(f"codec {str(self)} not implemented")
+
+    def decode(self, data: np.array, params: np.array) -> np.array:
+        """
+        Decode the processed data of a file, see encode.
+
+        Parameters:
+            data (np.array): The encoded data.
+            params (np.array): The parameters returned by encode.
+
+        Returns:
+            np.array: 2D array with one window per row and one frequency per column.
+        """
+        if self == Codec.NONE:
+            return data
+
+        if self == Codec.FLOAT16:
+            return data.astype(np.float32)
+
+        if self in [Codec.UINT8, Codec.UINT16]:
+            power = data.astype(np.float32)
+            power *= np.float32(params[1])
+            power += np.float32(params[0])
+            if len(params) > 2:
+                maximum = np.iinfo(data.dtype).max
+                for code, value in zip(range(maximum, maximum - int(params[2]), -1),
+                                       _RESERVED_VALUES):
+                    power[data == code] = value
+            return power
+
+        if self == Codec.LOSSLESS:
+            n_rows, n_cols, itemsize = (int(value) for value in params)
+            shuffled = np.frombuffer(zlib.decompress(np.ascontiguousarray(data).tobytes()),
+                                     dtype=np.uint8).reshape(itemsize, -1)
+            return np.ascontiguousarray(shuffled.T).view(f'<f{itemsize}').reshape(n_rows, n_cols)
+
+        raise UnboundLocalError(f"codec {str(self)} not implemented")
+
+
+class BaseStorage():
+    """ Abstract base class for the storage of processed data in an output directory. """
+    # if False, files can only be removed all together, with clear
+    SINGLE_FILE_REMOVAL = True
+    # if False, get_shape loads the data of the file
+    SHAPE_WITHOUT_LOAD = False
+
+    def __init__(self, output_dir: str, codec: Codec = Codec.NONE) -> None:
+        """
+        Parameters:
+            output_dir (str): Directory where the processed data is kept.
+            codec (Codec): Encoding of the saved data. The data is decoded on load with the codec
+                it was saved with. Default is Codec.NONE
+        """
+        self.output_dir = output_dir
+        self.codec = codec
+
+    @abc.abstractmethod
+    def exists(self, file_id: int) -> bool:
+        """ Check if the processed data of file_id is available. """
+
+    @abc.abstractmethod
+    def save(self, file_id: int, power: np.array, times: np.array) -> None:
+        """
+        Store the processed data of a file.
+
+        Parameters:
+            file_id (int): ID of the file.
+            power (np.array): 2D array with one window per row and one frequency per column.
+            times (np.array): 1D array with the time of each window.
+        """
+
+    def save_blocks(self, file_id: int, blocks: typing.Iterable[np.array], times: np.array,
+                    n_cols: int) -> None:
+        """
+        Store the processed data of a file given in consecutive blocks of windows. Storages that
+            can write each block as it is received override this method, keeping only one block
+            in memory.
+
+        Parameters:
+            file_id (int): ID of the file.
+            blocks (Iterable[np.array]): 2D arrays with consecutive windows, one per row.
+            times (np.array): 1D array with the time of each window.
+            n_cols (int): Number of frequencies, columns of each block.
+        """
+        self.save(file_id, np.concatenate(list(blocks)).reshape(-1, n_cols), times)
+
+    @abc.abstractmethod
+    def load(self, file_id: int) -> typing.Tuple[np.array, np.array]:
+        """
+        Load the processed data of a file.
+
+        Parameters:
+            file_id (int): ID of the file.
+
+        Returns:
+            Tuple[np.array, np.array]: 2D array with one window per row and one frequency per
+                column, and the time of each window.
+        """
+
+    def load_range(self, file_id: int, start_time: float = None, end_time: float = None) \
+            -> typing.Tuple[np.array, np.array]:
+        """
+        Load the windows of the processed data of a file with start_time <= time <= end_time.
+            Storages that can read part of a file override this method, reading only the rows in
+            the range.
+
+        Parameters:
+            file_id (int): ID of the file.
+            start_time (float): First time of the range. Default is None, from the first window.
+            end_time (float): Last time of the range. Default is None, to the last window.
+
+        Returns:
+            Tuple[np.array, np.array]: As load, only with the windows in the range.
+        """
+        power, times = self.load(file_id)
+        times = np.asarray(times)
+        rows = time_range_slice(times, start_time, end_time)
+        return power[rows], times[rows]
+
+    def get_shape(self, file_id: int) -> typing.Tuple[int, int]:
+        """
+        Get the shape of the processed data of a file, (n_windows, n_frequencies). Storages that
+            keep the shape apart from the data override this method, not loading the file.
+        """
+        power, _ = self.load(file_id)
+        return power.shape
+
+    @abc.abstractmethod
+    def get_file_ids(self) -> typing.List[int]:
+        """ Get the IDs of all files available in the storage. """
+
+    @abc.abstractmethod
+    def get_size(self, file_id: int) -> int:
+        """ Get the size in bytes of the processed data of a file. """
+
+    @abc.abstractmethod
+    def remove(self, file_id: int) -> None:
+        """ Remove the processed data of a file. """
+
+    def clear(self) -> None:
+        """ Remove the processed data of all files. """
+        for file_id in self.get_file_ids():
+            self.remove(file_id)
+
+    def file_lock(self, file_id: int) -> FileLock:
+        """
+        Get the lock of a file, to be held while processing and saving it, so that only one of
+            the threads and processes sharing the output directory processes it.
+
+        Parameters:
+            file_id (int): ID of the file.
+
+        Returns:
+            FileLock: The lock, to be used as a context.
+        """
+        return FileLock(os.path.join(self.output_dir, 'locks', f'{file_id}.lock'))
+
+    def validate(self, file_id: int) -> bool:
+        """ Check if the processed data of a file can be loaded and is consistent. """
+        try:
+            power, times = self.load(file_id)
+            return power.ndim == 2 and power.shape[0] == len(times)
+        except Exception: # pylint: disable=broad-except
+            return False
+
+    def _get_ids_by_suffix(self, suffix: str) -> typing.List[int]:
+        """ Get the IDs of the files in the output directory named as {file_id}{suffix}. """
+        if not os.path.isdir(self.output_dir):
+            return []
+
+        file_ids = []
+        for file in os.listdir(self.output_dir):
+            if file.endswith(suffix):
+                try:
+                    file_ids.append(int(file[:-len(suffix)]))
+                except ValueError:
+                    pass
+        return file_ids
+
+
+class PickleStorage(BaseStorage):
+    """
+    Storage keeping each file as a pickled dict with the DataFrame and the times, or, with a
+        codec, with the encoded data, the codec and its parameters.
+    """
+
+    def _get_filename(self, file_id: int) -> str:
+        return os.path.join(self.output_dir, f'{file_id}.pkl')
+
+    def exists(self, file_id: int) -> bool:
+        return os.path.exists(self._get_filename(file_id))
+
+    def save(self, file_id: int, power: np.array, times: np.array) -> None:
+        if self.codec == Codec.NONE:
+            content = {'df': to_df(power), 'times': times}
+        else:
+            data, params = self.codec.encode(power)
+            content = {'codec': str(self.codec), 'data': data, 'params': params, 'times': times}
+
+        with atomic_write(self._get_filename(file_id)) as filename:
+            pd.to_pickle(content, filename)
+
+    def load(self, file_id: int) -> typing.Tuple[np.array, np.array]:
+        data = pd.read_pickle(self._get_filename(file_id))
+        if 'codec' in data:
+            codec = Codec[data['codec'].upper()]
+            return codec.decode(data['data'], data['params']), np.asarray(data['times'])
+        # the first release kept the times as a list
+        return data['df'].to_numpy(), np.asarray(data['times'])
+
+    def get_file_ids(self) -> typing.List[int]:
+        return self._get_ids_by_suffix('.pkl')
+
+    def get_size(self, file_id: int) -> int:
+        return os.path.getsize(self._get_filename(file_id))
+
+    def remove(self, file_id: int) -> None:
+        os.remove(self._get_filename(file_id))
+
+
+class NumpyStorage(BaseStorage):
+    """
+    Storage keeping each file as a raw float32 .npy array, with the times in a sidecar .npy file.
+
+    The arrays are loaded as copy-on-write memory maps, so the data is read on demand, shared
+        between processes through the page cache and can be wrapped in tensors without copies.
+        With a codec, the .npy keeps the encoded data, with the codec and its parameters in a
+        third sidecar file, and it is decoded to memory on load.
+    """
+    DTYPE = np.float32
+    SHAPE_WITHOUT_LOAD = True
+
+    def _get_filename(self, file_id: int) -> str:
+        return os.path.join(self.output_dir, f'{file_id}.npy')
+
+    def _get_times_filename(self, file_id: int) -> str:
+        return os.path.join(self.output_dir, f'{file_id}_times.npy')
+
+    def _get_codec_filename(self, file_id: int) -> str:
+        return os.path.join(self.output_dir, f'{file_id}_codec.npy')
+
+    def exists(self, file_id: int) -> bool:
+        return os.path.exists(self._get_filename(file_id)) and \
+                os.path.exists(self._get_times_filename(file_id))
+
+    @staticmethod
+    def _save_array(filename: str, array: np.array) -> None:
+        with atomic_write(filename, '.npy') as tmp_filename:
+            np.save(tmp_filename, array, allow_pickle=False)
+
+    def save(self, file_id: int, power: np.array, times: np.array) -> None:
+        # the power is written last, as exists checks it
+        NumpyStorage._save_array(self._get_times_filename(file_id),
+                                 np.asarray(times, dtype=np.float64))
+        power = np.ascontiguousarray(power, dtype=NumpyStorage.DTYPE)
+
+        if self.codec != Codec.NONE:
+            power, params = self.codec.encode(power)
+            NumpyStorage._save_array(self._get_codec_filename(file_id),
+                                     np.concatenate([[self.codec.value], params]))
+        elif os.path.exists(self._get_codec_filename(file_id)):
+            os.remove(self._get_codec_filename(file_id))
+
+        NumpyStorage._save_array(self._get_filename(file_id), power)
+
+    def save_blocks(self, file_id: int, blocks: typing.Iterable[np.array], times: np.array,
+                    n_cols: int) -> None:
+        if self.codec != Codec.NONE:
+            # the codecs scale by the whole file
+            super().save_blocks(file_id, blocks, times, n_cols)
+            return
+
+        NumpyStorage._save_array(self._get_times_filename(file_id),
+                                 np.asarray(times, dtype=np.float64))
+        if os.path.exists(self._get_codec_filename(file_id)):
+            os.remove(self._get_codec_filename(file_id))
+
+        with atomic_write(self._get_filename(file_id), '.npy') as filename:
+            power = np.lib.format.open_memmap(filename, mode='w+', dtype=NumpyStorage.DTYPE,
+                                              shape=(len(times), n_cols))
+            position = 0
+            for block in blocks:
+                power[position:position + len(block)] = block
+                position += len(block)
+            power.flush()
+            del power
+
+    def load(self, file_id: int) -> typing.Tuple[np.array, np.array]:
+        power = np.load(self._get_filename(file_id), mmap_mode='c', allow_pickle=False)
+        times = np.load(self._get_times_filename(file_id), allow_pickle=False)
+
+        if os.path.exists(self._get_codec_filename(file_id)):
+            params = np.load(self._get_codec_filename(file_id), allow_pickle=False)
+            power = Codec(int(params[0])).decode(power, params[1:])
+
+        return power, times
+
+    def load_range(self, file_id: int, start_time: float = None, end_time: float = None) \
+            -> typing.Tuple[np.array, np.array]:
+        power = np.load(self._get_filename(file_id), mmap_mode='c', allow_pickle=False)
+        times = np.load(self._get_times_filename(file_id), allow_pickle=False)
+        rows = time_range_slice(times, start_time, end_time)
+
+        if os.path.exists(self._get_codec_filename(file_id)):
+            params = np.load(self._get_codec_filename(file_id), allow_pickle=False)
+            codec = Codec(int(params[0]))
+            if codec == Codec.LOSSLESS:
+                # compressed as a whole
+                return codec.decode(power, params[1:])[rows], times[rows]
+            return codec.decode(power[rows], params[1:]), times[rows]
+
+        return power[rows], times[rows]
+
+    def get_shape(self, file_id: int) -> typing.Tuple[int, int]:
+        if os.path.exists(self._get_codec_filename(file_id)):
+            params = np.load(self._get_codec_filename(file_id), allow_pickle=False)
+            if Codec(int(params[0])) == Codec.LOSSLESS:
+                # the .npy keeps the compressed bytes, the shape is in the parameters
+                return int(params[1]), int(params[2])
+        return np.load(self._get_filename(file_id), mmap_mode='r', allow_pickle=False).shape
+
+    def get_file_ids(self) -> typing.List[int]:
+        return [file_id for file_id in self._get_ids_by_suffix('.npy')
+                if os.path.exists(self._get_times_filename(file_id))]
+
+    def get_size(self, file_id: int) -> int:
+        size = os.path.getsize(self._get_filename(file_id)) + \
+                os.path.getsize(self._get_times_filename(file_id))
+        if os.path.exists(self._get_codec_filename(file_id)):
+            size += os.path.getsize(self._get_codec_filename(file_id))
+        return size
+
+    def remove(self, file_id: int) -> None:
+        os.remove(self._get_filename(file_id))
+        os.remove(self._get_times_filename(file_id))
+        if os.path.exists(self._get_codec_filename(file_id)):
+            os.remove(self._get_codec_filename(file_id))
+
+
+class ConsolidatedStorage(BaseStorage):
+    """
+    Storage packing all processed files of a processor configuration in a single append-only file.
+
+    Each file is appended as one chunk: a header with (magic, file_id, n_rows, n_cols) as int64,
+        the times of the windows as float64 and the power as float32. The offset table, from
+        file_id to the position of its chunk, is rebuilt from the headers, so the store can be
+        copied between nodes as one file. Reads are views over a copy-on-write memory map of the
+        whole store. Chunks cannot be removed, only the whole store, with clear.
+
+    The appends are serialized between processes by a FileLock, and the magic of each chunk is
+        only written after its data, so a chunk is never visible before complete and the chunk
+        of a crashed writer is overwritten by the next append, or dropped by repair. save_blocks
+        spills the blocks to a temporary file before taking the lock, so the processing of
+        a file does not hold the appends of the other workers.
+    """
+    SINGLE_FILE_REMOVAL = False
+    SHAPE_WITHOUT_LOAD = True
+    FILENAME = 'data.store'
+    MAGIC = 0x41524149
+    HEADER_SIZE = 4 * 8
+    DTYPE = np.float32
+
+    def __init__(self, output_dir: str, codec: Codec = Codec.NONE) -> None:
+        if codec != Codec.NONE:
+            raise UnboundLocalError(f"codec {str(codec)} not implemented in consolidated storage")
+        super().__init__(output_dir, codec)
+        self.filename = os.path.join(output_dir, ConsolidatedStorage.FILENAME)
+        self.offsets = {}
+        self.scanned_size = 0
+        self.buffer = None
+        self.lock = threading.RLock()
+
+    def _scan(self) -> None:
+        """ Update the offset table with the chunks appended since the last scan. """
+        if not os.path.exists(self.filename):
+            return
+
+        file_size = os.path.getsize(self.filename)
+        if file_size == self.scanned_size:
+            return
+
+        with open(self.filename, 'rb') as f:
+            position = self.scanned_size
+            while position + ConsolidatedStorage.HEADER_SIZE <= file_size:
+                f.seek(position)
+                header = np.frombuffer(f.read(ConsolidatedStorage.HEADER_SIZE), dtype='<i8')
+                magic, file_id, n_rows, n_cols = (int(value) for value in header)
+
+                times_offset = position + ConsolidatedStorage.HEADER_SIZE
+                power_offset = times_offset + n_rows * 8
+                end = power_offset + n_rows * n_cols * 4
+
+                if magic != ConsolidatedStorage.MAGIC or end > file_size:
+                    break
+
+                self.offsets[file_id] = (times_offset, power_offset, n_rows, n_cols)
+                position = end
+
+        self.scanned_size = position
+
+    def _get_buffer(self, end: int) -> np.array:
+        if self.buffer is None or len(self.buffer) < end:
+            self.buffer = np.memmap(self.filename, dtype=np.uint8, mode='c')
+        return self.buffer
+
+    def get_file_ids(self) -> typing.List[int]:
+        """ Get the IDs of all files available in the store. """
+        with self.lock:
+            self._scan()
+            return list(self.offsets.keys())
+
+    def exists(self, file_id: int) -> bool:
+        with self.lock:
+            if file_id not in self.offsets:
+                self._scan()
+            return file_id in self.offsets
+
+    def save(self, file_id: int, power: np.array, times: np.array) -> None:
+        power = np.ascontiguousarray(power, dtype='<f4')
+        self._append(file_id, times, power.shape[1], lambda f: f.write(power.tobytes()))
+
+    def save_blocks(self, file_id: int, blocks: typing.Iterable[np.array], times: np.array,
+                    n_cols: int) -> None:
+        # the blocks may be computed as they are iterated, so they are spilled to a temporary
+        # file without the store lock, held only to copy them to the store
+        spill_filename = f'{self.filename}.{file_id}.{os.getpid()}.' \
+                         f'{threading.get_ident()}{TMP_SUFFIX}'
+        try:
+            with open(spill_filename, 'w+b') as spill:
+                for block in blocks:
+                    spill.write(np.ascontiguousarray(block, dtype='<f4').tobytes())
+                spill.seek(0)
+                self._append(file_id, times, n_cols,
+                             lambda f: shutil.copyfileobj(spill, f, 16 * 1024 * 1024))
+        finally:
+            if os.path.exists(spill_filename):
+                os.remove(spill_filename)
+
+    def _append(self, file_id: int, times: np.array, n_cols: int,
+                write_power: typing.Callable[[typing.BinaryIO], None]) -> None:
+        """ Append the chunk of a file to the store, holding the store lock, with the power
+        written to the store file by write_power. """
+        times = np.ascontiguousarray(times, dtype='<f8')
+        header = np.array([ConsolidatedStorage.MAGIC, file_id, len(times), n_cols], dtype='<i8')
+
+        with self.lock, self._get_store_lock():
+            self._scan()
+            mode = 'r+b' if os.path.exists(self.filename) else 'wb'
+            with open(self.filename, mode) as f:
+                # overwrites any incomplete chunk left after the last valid one
+                f.seek(self.scanned_size)
+                f.write(np.concatenate([[0], header[1:]]).astype('<i8').tobytes())
+                f.write(times.tobytes())
+                write_power(f)
+                f.flush()
+                f.seek(self.scanned_size)
+                f.write(header[:1].tobytes())
+            self._scan()
+
+    def load(self, file_id: int) -> typing.Tuple[np.array, np.array]:
+        with self.lock:
+            if file_id not in self.offsets:
+                self._scan()
+            times_offset, power_offset, n_rows, n_cols = self.offsets[file_id]
+            buffer = self._get_buffer(power_offset + n_rows * n_cols * 4)
+
+        times = buffer[times_offset:power_offset].view('<f8')
+        power = buffer[power_offset:power_offset + n_rows * n_cols * 4].view('<f4')
+        return power.reshape(n_rows, n_cols), np.array(times)
+
+    def load_range(self, file_id: int, start_time: float = None, end_time: float = None) \
+            -> typing.Tuple[np.array, np.array]:
+        with self.lock:
+            if file_id not in self.offsets:
+                self._scan()
+            times_offset, power_offset, n_rows, n_cols = self.offsets[file_id]
+            buffer = self._get_buffer(power_offset + n_rows * n_cols * 4)
+
+        times = buffer[times_offset:power_offset].view('<f8')
+        rows = time_range_slice(times, start_time, end_time)
+        row_size = n_cols * 4
+        power = buffer[power_offset + rows.start * row_size:power_offset + rows.stop * row_size]
+        return power.view('<f4').reshape(-1, n_cols), np.array(times[rows])
+
+    def get_shape(self, file_id: int) -> typing.Tuple[int, int]:
+        with self.lock:
+            if file_id not in self.offsets:
+                self._scan()
+            _, _, n_rows, n_cols = self.offsets[file_id]
+        return n_rows, n_cols
+
+    def get_size(self, file_id: int) -> int:
+        with self.lock:
+            if file_id not in self.offsets:
+                self._scan()
+            _, _, n_rows, n_cols = self.offsets[file_id]
+        return ConsolidatedStorage.HEADER_SIZE + n_rows * 8 + n_rows * n_cols * 4
+
+    def remove(self, file_id: int) -> None:
+        raise UnboundLocalError("consolidated storage does not remove single files")
+
+    def clear(self) -> None:
+        with self.lock, self._get_store_lock():
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+            self.offsets = {}
+            self.scanned_size = 0
+            self.buffer = None
+
+    def _get_store_lock(self) -> FileLock:
+        return FileLock(os.path.join(self.output_dir, 'locks',
+                                     f'{ConsolidatedStorage.FILENAME}.lock'))
+
+    def get_incomplete_size(self) -> int:
+        """ Get the size in bytes of the incomplete chunk left after the valid ones, if any. """
+        with self.lock:
+            self._scan()
+            if not os.path.exists(self.filename):
+                return 0
+            return os.path.getsize(self.filename) - self.scanned_size
+
+    def repair(self) -> None:
+        """ Truncate the store after the last valid chunk. """
+        with self.lock, self._get_store_lock():
+            self._scan()
+            if os.path.exists(self.filename):
+                self.buffer = None
+                os.truncate(self.filename, self.scanned_size)
+
+
+class CompressedStorage(BaseStorage):
+    """
+    Storage keeping each file as a zlib compressed .npz, in the 'compressed' subdirectory of the
+        output directory. Used as a lower tier by iara.processing.cache.CacheManager, that demotes
+        the least recently used files to it.
+    """
+    DIRNAME = 'compressed'
+
+    def __init__(self, output_dir: str) -> None:
+        super().__init__(os.path.join(output_dir, CompressedStorage.DIRNAME))
+
+    def _get_filename(self, file_id: int) -> str:
+        return os.path.join(self.output_dir, f'{file_id}.npz')
+
+    def exists(self, file_id: int) -> bool:
+        return os.path.exists(self._get_filename(file_id))
+
+    def save(self, file_id: int, power: np.array, times: np.array) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        with atomic_write(self._get_filename(file_id), '.npz') as filename:
+            np.savez_compressed(filename, power=power, times=times)
+
+    def load(self, file_id: int) -> typing.Tuple[np.array, np.array]:
+        with np.load(self._get_filename(file_id), allow_pickle=False) as data:
+            return data['power'], data['times']
+
+    def get_file_ids(self) -> typing.List[int]:
+        return self._get_ids_by_suffix('.npz')
+
+    def get_size(self, file_id: int) -> int:
+        return os.path.getsize(self._get_filename(file_id))
+
+    def remove(self, file_id: int) -> None:
+        os.remove(self._get_filename(file_id))
+
+
+class StageStore():
+    """
+    Store of the intermediate results of the processing of one raw file (see
+        iara.processing.analysis.Stage), shared by all processor configurations over the same
+        raw data, so that a new configuration starts from the deepest stage already computed.
+
+    Each stage key is kept in a directory named by the hash of the key, with one pickle per raw
+        file and a key.txt describing the key.
+    """
+
+    def __init__(self, output_dir: str, data_base_dir: str, file_id: int) -> None:
+        """
+        Parameters:
+            output_dir (str): Directory where the stages are kept.
+            data_base_dir (str): Base directory of the raw data, part of all keys.
+            file_id (int): ID of the raw file.
+        """
+        self.output_dir = output_dir
+        self.data_base_dir = data_base_dir
+        self.file_id = file_id
+
+    def _get_dir(self, key: typing.Tuple) -> str:
+        description = str((self.data_base_dir,) + tuple(key))
+        return os.path.join(self.output_dir, hashlib.md5(description.encode()).hexdigest())
+
+    def _get_filename(self, key: typing.Tuple) -> str:
+        return os.path.join(self._get_dir(key), f'{self.file_id}.pkl')
+
+    def load(self, key: typing.Tuple) -> typing.Any:
+        """
+        Load a stage result.
+
+        Parameters:
+            key (Tuple): Key of the stage result.
+
+        Returns:
+            Any: The stored result, or None when it is not available.
+        """
+        filename = self._get_filename(key)
+        if not os.path.exists(filename):
+            return None
+        # the modification time is the last access of the stage for the CacheManager
+        os.utime(filename)
+        return pd.read_pickle(filename)
+
+    def save(self, key: typing.Tuple, value: typing.Any) -> None:
+        """
+        Store a stage result.
+
+        Parameters:
+            key (Tuple): Key of the stage result.
+            value (Any): The result.
+        """
+        directory = self._get_dir(key)
+        os.makedirs(directory, exist_ok=True)
+        description_file = os.path.join(directory, 'key.txt')
+        if not os.path.exists(description_file):
+            with atomic_write(description_file) as filename:
+                with open(filename, 'w', encoding='utf-8') as f:
+                    f.write(str((self.data_base_dir,) + tuple(key)))
+        with atomic_write(self._get_filename(key)) as filename:
+            pd.to_pickle(value, filename)
+
+
+class StorageType(enum.Enum):
+    """ Enum defining the available formats to store processed data. """
+    PICKLE = 0
+    NUMPY = 1
+    CONSOLIDATED = 2
+
+    def __str__(self):
+        return str(self.name).rsplit('.', maxsplit=1)[-1].lower()
+
+    def build(self, output_dir: str, codec: Codec = Codec.NONE) -> BaseStorage:
+        """
+        Build the storage of this type for an output directory.
+
+        Parameters:
+            output_dir (str): Directory where the processed data is kept.
+            codec (Codec): Encoding of the saved data. Default is Codec.NONE
+
+        Returns:
+            BaseStorage: The storage object.
+        """
+        if self == StorageType.PICKLE:
+            return PickleStorage(output_dir, codec)
+
+        if self == StorageType.NUMPY:
+            return NumpyStorage(output_dir, codec)
+
+        if self == StorageType.CONSOLIDATED:
+            return ConsolidatedStorage(output_dir, codec)
+
+        raise UnboundLocalError(f"storage {str(self)} not implemented")
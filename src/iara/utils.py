@@ -14,20 +14,22 @@ import psutil
 
 import numpy as np
 
-import torch
+# torch is imported where used, so the processing modules can use these utils without loading it
 
 
-def get_available_device() -> torch.device:
+def get_available_device() -> 'torch.device':
     """
     Get the available device for computation.
 
     Returns:
         torch.device: The available device, either 'cuda' (GPU) or 'cpu'.
     """
+    import torch
     return torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
 
 def print_available_device():
     """ Print the available device for computation. """
+    import torch
     if torch.cuda.is_available():
         device = torch.cuda.current_device()
         print(f"Using GPU: {torch.cuda.get_device_name(device)}")
@@ -36,6 +38,7 @@ def print_available_device():
 
 def set_seed():
     """ Set random seed for reproducibility. """
+    import torch
     seed = 42
     random.seed(seed)
     np.random.seed(seed)
@@ -68,6 +71,7 @@ def backup_folder(base_dir, time_str_format = "%Y%m%d-%H%M%S"):
 
 def available_gpu_memory() -> float:
     """Get the gpu available memory em bytes."""
+    import torch
 
     if not torch.cuda.is_available():
         return 0
@@ -0,0 +1,59 @@
+"""
+Decimation Benchmark Program
+
+This script compares the execution time of the decimation engines and checks that the polyphase
+engine keeps the in-band spectrum of the Chebyshev engine and gives the same output when run in
+blocks.
+"""
+import sys
+import time
+
+import numpy as np
+import scipy.signal as sci
+
+import iara.processing.analysis as iara_proc
+
+
+def main(n_repetitions: int = 3, max_band_error_db: float = 0.2) -> bool:
+    """Main function comparing the decimation engines."""
+    rng = np.random.default_rng(42)
+
+    fs = 52734
+    t = np.arange(60 * fs) / fs
+    data = 1e3 * np.sin(2 * np.pi * 440 * t) + 1e2 * rng.standard_normal(len(t))
+
+    success = True
+    for rate in [3, 2, 1, fs/16000]:
+        results = {}
+        for engine in iara_proc.DecimationEngine:
+            start = time.time()
+            for _ in range(n_repetitions):
+                results[engine] = iara_proc.decimate(data, rate, engine)
+            elapsed = (time.time() - start) / n_repetitions
+            print(f'rate {rate:.4f} - {engine}: {elapsed*1e3:.2f} ms')
+
+        reference = results[iara_proc.DecimationEngine.CHEBYSHEV]
+        result = results[iara_proc.DecimationEngine.POLYPHASE]
+
+        blocks = np.concatenate(list(iara_proc.decimate_blocks(data, rate, block_size=2**16)))
+        block_match = np.allclose(blocks, result, rtol=1e-9, atol=1e-6)
+
+        length_match = len(result) == len(reference)
+
+        freq, psd_reference = sci.welch(reference, fs/rate, nperseg=4096)
+        _, psd_result = sci.welch(result, fs/rate, nperseg=4096)
+        band = freq < 0.7 * fs / rate / 2
+        band_error = np.max(np.abs(10 * np.log10(psd_result[band] / psd_reference[band])))
+        band_match = band_error < max_band_error_db
+
+        match = block_match and length_match and band_match
+        success = success and match
+
+        print(f'rate {rate:.4f}: {"OK" if match else "FAIL"} - length {length_match}, '
+              f'blocks {block_match}, max in-band error {band_error:.3f} dB')
+
+    return success
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
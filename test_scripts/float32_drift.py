@@ -0,0 +1,72 @@
+"""
+Float32 Drift Report Program
+
+This script processes a signal with the default IARA processors in float64 and in float32 and
+reports the numeric drift of the float32 results in relation to the float64 reference. The drift
+is evaluated by its mean and its 99.9 percentile, since the lofar threshold on -0.2 flips a few
+isolated bins near it. The data of a wav file can be given as argument, otherwise a synthetic
+signal is used.
+"""
+import sys
+import time
+
+import numpy as np
+import scipy.io.wavfile as scipy_wav
+
+import iara.processing.analysis as iara_proc
+
+
+def get_processors():
+    """ Analyses of the default lofar and mel processors, with the normalization. """
+    kwargs = {'n_pts': 1024, 'n_overlap': 0, 'decimation_rate': 3, 'integration_interval': 0.512}
+    processors = {}
+    for engine in iara_proc.DecimationEngine:
+        processors[f'lofar {engine}'] = (iara_proc.SpectralAnalysis.LOFAR, engine, kwargs)
+        for n_mels in [16, 256]:
+            processors[f'mel {n_mels} {engine}'] = (iara_proc.SpectralAnalysis.LOG_MELGRAM, engine,
+                                                    dict(kwargs, n_mels=n_mels))
+    return processors
+
+def main(max_percentile_error: float = 1e-3, max_mean_error: float = 1e-4) -> bool:
+    """Main function reporting the drift of the float32 processing."""
+
+    if len(sys.argv) > 1:
+        fs, data = scipy_wav.read(sys.argv[1])
+        data = data if data.ndim == 1 else data[:, 0]
+    else:
+        rng = np.random.default_rng(42)
+        fs = 52734
+        t = np.arange(60 * fs) / fs
+        data = 1e3 * np.sin(2 * np.pi * 440 * t) + 1e2 * rng.standard_normal(len(t))
+        data = data.astype(np.int16)
+
+    normalization = iara_proc.Normalization.NORM_L2
+
+    success = True
+    for name, (analysis, engine, kwargs) in get_processors().items():
+        results = {}
+        for dtype in [np.float64, np.float32]:
+            start = time.time()
+            power, _, _ = analysis.apply_cached(iara_proc.SignalCache(data, fs, engine, dtype),
+                                                    **kwargs)
+            results[dtype] = (normalization(power), time.time() - start)
+
+        reference, reference_time = results[np.float64]
+        result, result_time = results[np.float32]
+
+        error = np.abs(result.astype(np.float64) - reference) / np.max(np.abs(reference))
+        percentile_error = np.percentile(error, 99.9)
+        mean_error = np.mean(error)
+        match = result.dtype == np.float32 and percentile_error < max_percentile_error and \
+                mean_error < max_mean_error
+        success = success and match
+
+        print(f'{name}: {"OK" if match else "FAIL"} - relative error: '
+              f'max {np.max(error):.2e}, 99.9% {percentile_error:.2e}, mean {mean_error:.2e}'
+              f' - float64 {reference_time*1e3:.1f} ms, float32 {result_time*1e3:.1f} ms')
+
+    return success
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,65 @@
+"""
+Import Time Budget Program
+
+This script imports each module in a new interpreter, with python -X importtime, and checks that
+the import time is within its budget, reporting the heaviest direct imports of each module. The
+budgets, in seconds, can be given as arguments in the same order of BUDGETS.
+"""
+import os
+import sys
+import subprocess
+
+
+BUDGETS = {
+    'iara.records': 1.0,
+    'iara.processing.analysis': 0.5,
+}
+
+def import_times(module: str) -> dict:
+    """ Cumulative import time, in seconds, of module and of each of its direct imports not
+    loaded before it. """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True,
+                            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+
+    # the imports of a module are listed before it, one level deeper
+    times, children = {}, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative) / 1e6
+        elif depth == 0:
+            if name.strip() == module:
+                times = dict(children)
+                times[module] = int(cumulative) / 1e6
+            children = {}
+    return times
+
+def main(n_repetitions: int = 3) -> bool:
+    """Main function checking the import time budgets."""
+    budgets = dict(BUDGETS)
+    for module, budget in zip(BUDGETS.keys(), sys.argv[1:]):
+        budgets[module] = float(budget)
+
+    success = True
+    for module, budget in budgets.items():
+        # the fastest of the repetitions, less affected by the cold file system cache
+        times = min((import_times(module) for _ in range(n_repetitions)),
+                    key=lambda times: times[module])
+        match = times[module] <= budget
+        success = success and match
+
+        heaviest = sorted(((time, name) for name, time in times.items() if name != module),
+                          reverse=True)[:5]
+        print(f'{module}: {"OK" if match else "FAIL"} {times[module]*1e3:.0f} ms '
+              f'(budget {budget*1e3:.0f} ms) - heaviest: ' +
+              ', '.join(f'{name} {time*1e3:.0f} ms' for time, name in heaviest))
+
+    return success
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
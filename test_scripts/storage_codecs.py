@@ -0,0 +1,163 @@
+"""
+Storage Codecs Report Program
+
+This script stores the lofar and mel features of a signal with each codec available in each
+storage and reports the size, the load time and the error of the decoded data in relation to the
+range of the feature. The lossless codec must decode the stored data exactly and the lossy codecs
+must be within the resolution of their types, also keeping the NaN and infinite values of a
+feature with some of them in place. The pickles of the first release, with the times as a list,
+must still be read, whole or in a time range. The data of a wav file can be given as argument,
+otherwise a synthetic signal is used.
+"""
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+import pandas as pd
+import scipy.io.wavfile as scipy_wav
+
+import iara.processing.analysis as iara_proc
+import iara.processing.manager as iara_manager
+import iara.processing.storage as iara_storage
+
+
+MAX_ERRORS = {
+    iara_storage.Codec.NONE: 0,
+    iara_storage.Codec.LOSSLESS: 0,
+    iara_storage.Codec.FLOAT16: 2**-10,
+    iara_storage.Codec.UINT8: 0.5 / (2**8 - 1) + 1e-6,
+    iara_storage.Codec.UINT16: 0.5 / (2**16 - 1) + 1e-6,
+}
+
+# the quantized codecs reserve three codes for the NaN and infinite values
+NON_FINITE_MAX_ERRORS = {
+    **MAX_ERRORS,
+    iara_storage.Codec.UINT8: 0.5 / (2**8 - 4) + 1e-6,
+    iara_storage.Codec.UINT16: 0.5 / (2**16 - 4) + 1e-6,
+}
+
+def check_non_finite(power: np.array) -> bool:
+    """ Check that the codecs keep the NaN and infinite values in their positions, without
+    changing the error of the other values. """
+    rng = np.random.default_rng(0)
+    power = power.copy()
+    finite = np.ones(power.shape, dtype=bool)
+    for value in [np.nan, np.inf, -np.inf]:
+        rows = rng.integers(0, power.shape[0], 10)
+        cols = rng.integers(0, power.shape[1], 10)
+        power[rows, cols] = value
+        finite[rows, cols] = False
+    value_range = np.max(power[finite]) - np.min(power[finite])
+
+    success = True
+    for storage_type in [iara_storage.StorageType.PICKLE, iara_storage.StorageType.NUMPY]:
+        for codec in iara_storage.Codec:
+            with tempfile.TemporaryDirectory() as output_dir:
+                storage = storage_type.build(output_dir, codec)
+                storage.save(0, power, np.arange(power.shape[0], dtype=np.float64))
+                result = np.array(storage.load(0)[0], dtype=np.float64)
+
+            reference = power
+            if storage_type != iara_storage.StorageType.PICKLE:
+                reference = power.astype(np.float32)
+
+            error = np.max(np.abs(result[finite] - reference[finite])) / value_range
+            match = np.array_equal(result[~finite], reference[~finite], equal_nan=True) and \
+                    np.all(np.isfinite(result[finite])) and error <= NON_FINITE_MAX_ERRORS[codec]
+            success = success and match
+
+            print(f'non finite {storage_type} {codec}: {"OK" if match else "FAIL"} - '
+                  f'relative error {error:.2e}')
+
+    return success
+
+def check_legacy_pickle(power: np.array, times: np.array) -> bool:
+    """ Check that a pickle of the first release, keeping the times as a list, is read by the
+    processor, whole and in a time range. """
+    with tempfile.TemporaryDirectory() as base_dir:
+        processor = iara_manager.AudioFileProcessor(base_dir, base_dir,
+                                                    iara_proc.Normalization.NORM_L2,
+                                                    iara_proc.SpectralAnalysis.LOFAR)
+        os.makedirs(processor._get_output_dir(), exist_ok=True)
+        pd.to_pickle({'df': iara_storage.to_df(power), 'times': list(times)},
+                     os.path.join(processor._get_output_dir(), '0.pkl'))
+
+        start_time, end_time = times[len(times) // 4], times[len(times) // 2]
+        rows = (times >= start_time) & (times <= end_time)
+        try:
+            whole, whole_times = processor.get_array(0)
+            part, part_times = processor.get_array(0, start_time, end_time)
+        except AttributeError as exception:
+            print(f'legacy pickle: FAIL - {exception}')
+            return False
+
+    match = np.array_equal(whole, power) and np.array_equal(whole_times, times) and \
+            np.array_equal(part, power[rows]) and np.array_equal(part_times, times[rows])
+    print(f'legacy pickle: {"OK" if match else "FAIL"} - {len(part_times)} windows in the range')
+    return match
+
+def main(n_repetitions: int = 5) -> bool:
+    """Main function reporting the codecs of the storages."""
+
+    if len(sys.argv) > 1:
+        fs, data = scipy_wav.read(sys.argv[1])
+        data = data if data.ndim == 1 else data[:, 0]
+    else:
+        rng = np.random.default_rng(42)
+        fs = 52734
+        t = np.arange(60 * fs) / fs
+        data = 1e3 * np.sin(2 * np.pi * 440 * t) + 1e2 * rng.standard_normal(len(t))
+        data = data.astype(np.int16)
+
+    kwargs = {'n_pts': 1024, 'n_overlap': 0, 'decimation_rate': 3}
+    features = {
+        'lofar': iara_proc.SpectralAnalysis.LOFAR.apply(data, fs, **kwargs),
+        'mel': iara_proc.SpectralAnalysis.LOG_MELGRAM.apply(data, fs, n_mels=256, **kwargs),
+    }
+
+    success = True
+    for name, (power, _, times) in features.items():
+        power = iara_proc.Normalization.NORM_L2(power).T
+        value_range = np.max(power) - np.min(power)
+
+        for storage_type in iara_storage.StorageType:
+            for codec in iara_storage.Codec:
+                if storage_type == iara_storage.StorageType.CONSOLIDATED and \
+                        codec != iara_storage.Codec.NONE:
+                    continue
+
+                with tempfile.TemporaryDirectory() as output_dir:
+                    storage = storage_type.build(output_dir, codec)
+                    storage.save(0, power, times)
+                    size = sum(os.path.getsize(os.path.join(output_dir, file))
+                               for file in os.listdir(output_dir))
+
+                    start = time.time()
+                    for _ in range(n_repetitions):
+                        result, result_times = storage.load(0)
+                        result = np.array(result)
+                    load_time = (time.time() - start) / n_repetitions
+
+                # NONE and LOSSLESS keep the type of the storage, float32 in NUMPY
+                reference = power
+                if storage_type != iara_storage.StorageType.PICKLE:
+                    reference = power.astype(np.float32)
+
+                error = np.max(np.abs(result.astype(np.float64) - reference)) / value_range
+                match = result.shape == power.shape and np.array_equal(result_times, times) and \
+                        error <= MAX_ERRORS[codec]
+                success = success and match
+
+                print(f'{name} {storage_type} {codec}: {"OK" if match else "FAIL"} - '
+                      f'{size/1024:.0f} KB, relative error {error:.2e}, '
+                      f'load {load_time*1e3:.2f} ms')
+
+    success = check_non_finite(features['lofar'][0].T) and success
+    success = check_legacy_pickle(features['lofar'][0].T, features['lofar'][2]) and success
+    return success
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
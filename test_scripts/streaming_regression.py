@@ -0,0 +1,63 @@
+"""
+Streaming Regression Test Program
+
+This script checks that the spectral analyses computed in blocks by iara_proc.stream match the
+analyses over the whole signal, for several block sizes, and compares their execution time.
+"""
+import sys
+import time
+
+import numpy as np
+
+import iara.processing.analysis as iara_proc
+
+
+def main() -> bool:
+    """Main function comparing the streaming and the whole signal analyses."""
+    rng = np.random.default_rng(42)
+
+    fs = 52734
+    t = np.arange(60 * fs) / fs
+    data = (1e3 * np.sin(2 * np.pi * 440 * t) + 1e2 * rng.standard_normal(len(t)))
+    data = data.astype(np.int16)
+    engine = iara_proc.DecimationEngine.POLYPHASE
+
+    configs = [
+        {'decimation_rate': 3},
+        {'decimation_rate': 3, 'integration_interval': 0.512},
+        {'decimation_rate': 3, 'integration_interval': 0.512, 'stft_integration': True},
+        {'decimation_rate': 1, 'n_mels': 64, 'integration_interval': 0.3,
+            'integration_overlap': 0.1},
+        {'n_pts': 512, 'n_overlap': 256, 'decimation_rate': 2},
+        {'decimation_rate': fs/16000, 'integration_interval': 1, 'integration_overlap': 0.5,
+            'stft_integration': True},
+    ]
+
+    success = True
+    for analysis in iara_proc.SpectralAnalysis:
+        for kwargs in configs:
+            start = time.time()
+            reference, ref_freq, ref_time = analysis.apply_cached(
+                    iara_proc.SignalCache(data, fs, engine), **kwargs)
+            reference_time = time.time() - start
+
+            for block_size in [1500, 2**16]:
+                start = time.time()
+                blocks, freq, times = analysis.apply_stream(data, fs, decimation_engine=engine,
+                                                            block_size=block_size, **kwargs)
+                power = np.concatenate(list(blocks), axis=1)
+                stream_time = time.time() - start
+
+                match = power.shape == reference.shape and \
+                        np.allclose(power, reference, rtol=1e-9, atol=1e-6) and \
+                        np.allclose(freq, ref_freq) and np.allclose(times, ref_time)
+                success = success and match
+
+                print(f'{analysis} {kwargs} block_size {block_size}: {"OK" if match else "FAIL"}'
+                      f' - whole {reference_time*1e3:.2f} ms, stream {stream_time*1e3:.2f} ms')
+
+    return success
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
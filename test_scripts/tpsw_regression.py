@@ -0,0 +1,56 @@
+"""
+TPSW Regression Test Program
+
+This script checks that the vectorized TPSW matches the convolution based TPSW within float
+tolerance and compares their execution time.
+"""
+import sys
+import time
+
+import numpy as np
+
+import iara.processing.analysis as iara_proc
+
+
+def main(n_repetitions: int = 5) -> bool:
+    """Main function comparing the TPSW engines."""
+    rng = np.random.default_rng(42)
+
+    fs = 52734
+    t = np.arange(60 * fs) / fs
+    data = 1e3 * np.sin(2 * np.pi * 440 * t) + 1e2 * rng.standard_normal(len(t))
+    log_power, _, _ = iara_proc.log_spectrogram(data, fs, n_pts=1024, decimation_rate=3)
+
+    cases = {
+        'log_spectrogram': {'data': log_power},
+        'random': {'data': rng.standard_normal((2048, 300))},
+        'single spectrum': {'data': rng.standard_normal(1024)},
+        'custom parameters': {'data': rng.standard_normal((512, 50)), 'n': 12, 'p': 3, 'a': 1.5},
+        'n_pts': {'data': rng.standard_normal((1024, 50)), 'n_pts': 700},
+    }
+
+    success = True
+    for name, kwargs in cases.items():
+        start = time.time()
+        for _ in range(n_repetitions):
+            reference = iara_proc.tpsw(vectorized=False, **kwargs)
+        reference_time = (time.time() - start) / n_repetitions
+
+        start = time.time()
+        for _ in range(n_repetitions):
+            result = iara_proc.tpsw(vectorized=True, **kwargs)
+        vectorized_time = (time.time() - start) / n_repetitions
+
+        match = result.shape == reference.shape and \
+                np.allclose(result, reference, rtol=1e-9, atol=1e-9)
+        success = success and match
+
+        print(f'{name}: {"OK" if match else "FAIL"} '
+              f'max error {np.max(np.abs(result - reference)):.3e} - '
+              f'convolution {reference_time*1e3:.2f} ms, vectorized {vectorized_time*1e3:.2f} ms')
+
+    return success
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,86 @@
+import argparse
+import time
+
+import pandas as pd
+
+import iara.utils
+import iara.default as iara_default
+import iara.processing.cache as iara_cache
+
+
+UNITS = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+def str_to_bytes(size: str) -> int:
+    """ Converts a size as 500G, 1.5T or 1000000 to bytes """
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+def main(data_processed_base_dir: str,
+         budget: int,
+         demote: bool,
+         dry_run: bool,
+         only_report: bool,
+         validate: bool,
+         repair: bool):
+
+    manager = iara_cache.CacheManager(data_processed_base_dir = data_processed_base_dir,
+                                      budget = budget,
+                                      demote = demote)
+
+    with pd.option_context('display.max_rows', None, 'display.width', None):
+        print(manager.report())
+
+        if validate or repair:
+            problems = manager.validate(repair=repair, verbose=True)
+            print(f'{len(problems)} problems{" repaired" if repair else ""}')
+
+        if only_report or validate or repair:
+            return
+
+        size = manager.get_size()
+        print(f'Processed data: {size} bytes, budget {budget} bytes')
+        actions = manager.evict(dry_run=dry_run, verbose=True)
+        print(f'{len(actions)} actions{" (dry run)" if dry_run else ""}')
+
+        if not dry_run and actions:
+            print(manager.report())
+
+
+if __name__ == "__main__":
+    start_time = time.time()
+
+    parser = argparse.ArgumentParser(
+            description='Keep a processed data directory under a size budget, evicting the least'
+                        ' recently used processed files')
+    parser.add_argument('-d', '--dir', type=str,
+                        default=iara_default.DEFAULT_DIRECTORIES.process_dir,
+                        help='Processed data directory')
+    parser.add_argument('-b', '--budget', type=str, default='500G',
+                        help='Maximum size of the processed data, Example: 500G, 1.5T')
+    parser.add_argument('--demote', action='store_true', default=False,
+                        help='Compress the least recently used files before evicting them')
+    parser.add_argument('--dry_run', action='store_true', default=False,
+                        help='Only list the evictions')
+    parser.add_argument('--report', action='store_true', default=False,
+                        help='Only print the usage report')
+    parser.add_argument('--validate', action='store_true', default=False,
+                        help='Only check for invalid, incomplete and temporary files')
+    parser.add_argument('--repair', action='store_true', default=False,
+                        help='Only check for and remove invalid, incomplete and temporary files')
+
+    args = parser.parse_args()
+
+    main(data_processed_base_dir = args.dir,
+         budget = str_to_bytes(args.budget),
+         demote = args.demote,
+         dry_run = args.dry_run,
+         only_report = args.report,
+         validate = args.validate,
+         repair = args.repair)
+
+    end_time = time.time()
+    elapsed_time = end_time - start_time
+    print(f"Elapsed time: {iara.utils.str_format_time(elapsed_time)}")
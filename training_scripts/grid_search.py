@@ -521,7 +521,9 @@ def main(classifier: iara_default.Classifier,
          only_eval: bool,
          only_eval_completed: bool,
          only_sample: bool,
-         override: bool):
+         override: bool,
+         precompute: bool = False,
+         n_workers: int = 4):
     
     if only_eval_completed:
         only_eval = True
@@ -536,6 +538,16 @@ def main(classifier: iara_default.Classifier,
     grid_search = GridSearch()
     feature_dict_list = feature.get_feature_loop(classifier, training_strategy)
 
+    if precompute and not only_eval:
+        collection = iara_default.default_collection(only_sample=only_sample)
+        processors = [dp for _, _, dp in feature_dict_list]
+        file_ids = collection.to_df()['ID'].to_list()
+
+        if not all(dp.is_cached(file_id) for dp in processors for file_id in file_ids):
+            iara_manager.precompute(collection = collection,
+                                    processors = processors,
+                                    n_workers = min(n_workers, os.cpu_count()))
+
     for config_name, feature_id, dp in feature_dict_list if len(feature_dict_list) == 1 else \
                 tqdm.tqdm(feature_dict_list, leave=False, desc="Features", ncols=120):
 
@@ -624,6 +636,10 @@ if __name__ == "__main__":
                         help='Execute only in sample_dataset. For quick training and test.')
     parser.add_argument('--override', action='store_true', default=False,
                         help='Ignore old runs')
+    parser.add_argument('--precompute', action='store_true', default=False,
+                        help='Process all features of the grid in parallel before training')
+    parser.add_argument('-w', '--n_workers', type=int, default=4,
+                        help='Number of worker processes of --precompute, limited to the cpus')
     parser.add_argument('-h', '--help', action='help', help='Show this help message and exit')
 
     args = parser.parse_args()
@@ -655,7 +671,9 @@ if __name__ == "__main__":
             only_eval = args.only_eval,
             only_eval_completed = args.only_eval_completed,
             only_sample = args.only_sample,
-            override = args.override)
+            override = args.override,
+            precompute = args.precompute,
+            n_workers = args.n_workers)
 
 
     end_time = time.time()
@@ -0,0 +1,69 @@
+import argparse
+import time
+
+import iara.utils
+import iara.records
+import iara.default as iara_default
+import iara.processing.manager as iara_manager
+import iara.processing.storage as iara_storage
+
+
+def main(collection: iara.records.Collection,
+         features: list,
+         n_mels_list: list,
+         storage_type: iara_storage.StorageType,
+         n_workers: int,
+         only_sample: bool):
+
+    processors = []
+    for feature in features:
+        if feature == 'lofar':
+            processors.append(iara_default.default_iara_lofar_audio_processor())
+        elif feature == 'mel':
+            for n_mels in n_mels_list:
+                processors.append(iara_default.default_iara_mel_audio_processor(n_mels=n_mels))
+
+    for processor in processors:
+        processor.storage_type = storage_type
+
+    iara_manager.precompute(
+            collection = iara_default.default_collection(only_sample=only_sample,
+                                                         collection=collection),
+            processors = processors,
+            n_workers = n_workers)
+
+
+if __name__ == "__main__":
+    start_time = time.time()
+
+    feature_choices = ['lofar', 'mel']
+    collection_choices = [str(i) for i in iara.records.Collection]
+    storage_choices = [str(i) for i in iara_storage.StorageType]
+
+    parser = argparse.ArgumentParser(description='Fill the processed data storage of a collection')
+    parser.add_argument('-f', '--feature', type=str, default='lofar,mel',
+                        help=f'Features to process, comma separated in {feature_choices}')
+    parser.add_argument('--n_mels', type=str, default='256',
+                        help='Mel sizes to process, Example: 16,32,64')
+    parser.add_argument('-c', '--collection', type=str, choices=collection_choices,
+                        default=str(iara.records.Collection.OS), help='Collection to process')
+    parser.add_argument('-s', '--storage', type=str, choices=storage_choices,
+                        default=str(iara_storage.StorageType.PICKLE),
+                        help='Format to keep the processed data')
+    parser.add_argument('-w', '--n_workers', type=int, default=None,
+                        help='Number of worker processes. Default is the number of cpus')
+    parser.add_argument('--only_sample', action='store_true', default=False,
+                        help='Execute only in sample_dataset. For quick test.')
+
+    args = parser.parse_args()
+
+    main(collection = iara.records.Collection[args.collection],
+         features = [feature for feature in args.feature.split(',') if feature in feature_choices],
+         n_mels_list = iara.utils.str_to_list(args.n_mels, [256]),
+         storage_type = iara_storage.StorageType[args.storage.upper()],
+         n_workers = args.n_workers,
+         only_sample = args.only_sample)
+
+    end_time = time.time()
+    elapsed_time = end_time - start_time
+    print(f"Elapsed time: {iara.utils.str_format_time(elapsed_time)}")